@@ -1,54 +1,354 @@
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from flask import Flask, render_template_string, request, redirect, url_for, send_from_directory, flash
-from reading_core import process_folder
-import os, tempfile, zipfile, shutil
+from flask import Flask, Request, Response, g, jsonify, render_template_string, request, redirect, url_for, send_from_directory, flash, abort
+from jobs import JobStore
+import os, io, posixpath, tempfile, zipfile, zlib, shutil, hashlib, json, time, functools, base64, binascii, threading
 
 app = Flask(__name__)
 app.secret_key = "secret123"
 OUTPUT_FOLDER = "outputs"
+PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS", os.cpu_count() or 1))
+PARSER_BACKEND = os.environ.get("PARSER_BACKEND", "bs4")
+REPORT_FORMAT = os.environ.get("REPORT_FORMAT", "xlsx")
+PROFILER = os.environ.get("PROFILER", "cprofile")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+RESULT_MAX_BYTES = int(os.environ.get("RESULT_MAX_MB", 2048)) << 20
+RESULT_MAX_AGE = float(os.environ.get("RESULT_MAX_AGE_HOURS", 72)) * 3600
+# A queued or running job whose row hasn't changed for this long is assumed lost with
+# the worker that ran it (restart, deploy) and is no longer handed out for reuse
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_MINUTES", 30)) * 60
+# /events streams: how often the job store is checked, and how long one stream stays
+# open before the browser's EventSource reconnects
+EVENTS_POLL_SECONDS = float(os.environ.get("EVENTS_POLL_SECONDS", 0.5))
+EVENTS_MAX_SECONDS = float(os.environ.get("EVENTS_MAX_SECONDS", 600))
+# Open /events streams per process; each holds a gunicorn thread, so keep this below
+# GUNICORN_THREADS to leave threads for uploads and downloads
+EVENTS_MAX_STREAMS = int(os.environ.get("EVENTS_MAX_STREAMS", 16))
+# Upload caps: a whole request (Werkzeug answers 413 past it), one EPUB (a form upload,
+# an API part or a member of an uploaded zip), and what one EPUB's central directory may
+# say it expands to
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_MB", 1024)) << 20
+MAX_BOOK_BYTES = int(os.environ.get("MAX_BOOK_MB", 256)) << 20
+MAX_EXPANDED_BYTES = int(os.environ.get("MAX_EXPANDED_MB", 1024)) << 20
+MAX_ZIP_ENTRIES = int(os.environ.get("MAX_ZIP_ENTRIES", 10000))
+# JSON batches are held in memory and base64-decoded there, so they get a cap of their own
+MAX_JSON_BYTES = int(os.environ.get("MAX_JSON_MB", 8)) << 20
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-progress_status = {"percent": 0, "done": False, "zip_path": None, "error": None}
+# reading_core pulls in bs4, lxml and numpy. It is imported with the first upload
+# rather than at worker boot, so the upload form and /progress polling never pay for it.
 
-def _update_progress(p):
-    progress_status["percent"] = p
+# Per-book options the batch API accepts (process_folder's), with the values form uploads use
+BOOK_OPTION_DEFAULTS = {"feature_titles": None, "h1_candidates": None, "patch_enabled": True, "backup_enabled": False, "insert_after_id": "parent-p1"}
 
-def background_task(epub_path, job_id):
+@functools.lru_cache(maxsize=None)
+def _job_options():
+    """Everything besides the uploaded bytes that decides what a job produces."""
+    from reading_core import PIPELINE_VERSION
+    return {"pipeline": PIPELINE_VERSION, "parser_backend": PARSER_BACKEND, "report_format": REPORT_FORMAT, "feature_titles": None, "h1_candidates": None}
+
+@functools.lru_cache(maxsize=None)
+def _result_cache():
+    # Re-uploads with a few corrected chapters reuse the results of the unchanged ones
+    from reading_core import ResultCache
+    return ResultCache(
+        os.environ.get("RESULT_CACHE_DIR", os.path.join(OUTPUT_FOLDER, "chapter-cache")),
+        int(os.environ.get("RESULT_CACHE_MB", 512)) << 20
+    )
+
+jobs = JobStore(os.environ.get("JOBS_DB", os.path.join(OUTPUT_FOLDER, "jobs.sqlite3")))
+job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+
+def _progress_callback(job_id):
+    def update(current, total, stage, filename):
+        jobs.update(job_id, percent=int(current * 100 / total) if total else 0, current=current, total=total,
+                    stage=stage, current_file=filename)
+    return update
+
+def _progress_event(job):
+    """The job's progress as an /events payload: counts, stage, elapsed seconds and an ETA while running."""
+    current, total = job["current"] or 0, job["total"] or 0
+    end = job["updated"] if job["status"] != "running" else time.time()
+    elapsed = max(0.0, end - job["started"]) if job["started"] else 0.0
+    eta = None
+    if job["status"] == "running" and 0 < current < total:
+        eta = elapsed / current * (total - current)
+    event = {
+        "status": job["status"],
+        "current": current,
+        "total": total,
+        "percent": job["percent"],
+        "stage": job["stage"],
+        "filename": job["current_file"],
+        "elapsed": round(elapsed, 3),
+        "eta": round(eta, 3) if eta is not None else None
+    }
+    if job["status"] == "error":
+        event["error"] = job["error"]
+    return event
+
+# ---------- Progress streams ----------
+# Every /events stream of the process reads its job from one shared poller thread,
+# which fetches all watched jobs in a single query per EVENTS_POLL_SECONDS and wakes
+# the streams whose job changed. Past EVENTS_MAX_STREAMS open streams, /events
+# answers 503 and the progress page polls /api/jobs/<id> instead.
+
+class _Watch:
+    def __init__(self, job):
+        self.job = job
+        self.version = 0
+        self.streams = 0
+
+_watches = {}
+_watch_cond = threading.Condition()
+_watch_thread = None
+_stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+def _poll_watched():
+    while True:
+        with _watch_cond:
+            _watch_cond.wait_for(lambda: _watches)
+            job_ids = list(_watches)
+        try:
+            rows = jobs.get_many(job_ids)
+        except Exception:
+            rows = None
+        if rows is not None:
+            with _watch_cond:
+                for job_id in job_ids:
+                    watch = _watches.get(job_id)
+                    if watch is not None and rows.get(job_id) != watch.job:
+                        watch.job = rows.get(job_id)
+                        watch.version += 1
+                _watch_cond.notify_all()
+        time.sleep(EVENTS_POLL_SECONDS)
+
+def _watch(job):
+    global _watch_thread
+    with _watch_cond:
+        watch = _watches.get(job["job_id"])
+        if watch is None:
+            watch = _watches[job["job_id"]] = _Watch(job)
+        watch.streams += 1
+        if _watch_thread is None:
+            _watch_thread = threading.Thread(target=_poll_watched, name="events-poller", daemon=True)
+            _watch_thread.start()
+        _watch_cond.notify_all()
+    return watch
+
+def _unwatch(job_id):
+    with _watch_cond:
+        watch = _watches[job_id]
+        watch.streams -= 1
+        if not watch.streams:
+            del _watches[job_id]
+
+def _upload_path(job_id):
+    return os.path.join(OUTPUT_FOLDER, f"{job_id}.epub")
+
+# ---------- Uploads ----------
+# File parts are written by the multipart parser straight into OUTPUT_FOLDER, hashed as
+# they arrive, and renamed into place once queued: no second copy in memory or on disk.
+
+ZIP_MAGIC = b"PK\x03\x04"
+
+class Upload(io.BufferedRandom):
+    """Temp file in OUTPUT_FOLDER for one uploaded file, hashed as it is written.
+
+    A file that doesn't start like a zip or grows past limit gets .error and the rest of
+    its bytes are dropped rather than written."""
+    def __init__(self, limit, error=None):
+        fd, self.path = tempfile.mkstemp(dir=OUTPUT_FOLDER, suffix=".upload")
+        super().__init__(io.FileIO(fd, "r+"))
+        self.limit, self.error = limit, error
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self._head = b""
+
+    def write(self, data):
+        if self.error is None and self.size < len(ZIP_MAGIC):
+            self._head += bytes(data[:len(ZIP_MAGIC) - self.size])
+            if len(self._head) == len(ZIP_MAGIC) and self._head != ZIP_MAGIC:
+                self._reject("Not a zip archive")
+        self.size += len(data)
+        if self.error is None and self.size > self.limit:
+            self._reject(f"Larger than {self.limit >> 20} MB")
+        if self.error is None:
+            self.sha256.update(data)
+            super().write(data)
+        return len(data)
+
+    def _reject(self, error):
+        self.error = error
+        self.truncate(0)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return _new_upload(filename)
+
+app.request_class = UploadRequest
+
+def _new_upload(filename):
+    """An Upload for filename, removed at the end of the request unless _submit moved it."""
+    name = (filename or "").lower()
+    if name.endswith(".epub"):
+        upload = Upload(MAX_BOOK_BYTES)
+    elif name.endswith(".zip"):
+        upload = Upload(MAX_UPLOAD_BYTES)
+    else:
+        upload = Upload(0, error="Not an .epub or .zip file")
+    g.setdefault("uploads", []).append(upload)
+    return upload
+
+def _spool(stream, filename):
+    """Write a readable stream to a new Upload."""
+    upload = _new_upload(filename)
+    shutil.copyfileobj(stream, upload, 1 << 20)
+    return upload
+
+@app.teardown_request
+def _remove_uploads(exc):
+    for upload in g.pop("uploads", ()):
+        upload.close()
+        try:
+            os.remove(upload.path)
+        except FileNotFoundError:
+            pass
+
+def _check_zip(path, max_expanded):
+    """Validate a zip's central directory (read from the end of the file, members untouched); raises ValueError."""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            infos = zf.infolist()
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError, EOFError) as e:
+        raise ValueError(f"Unreadable zip: {e}")
+    if not infos:
+        raise ValueError("Empty zip")
+    if len(infos) > MAX_ZIP_ENTRIES:
+        raise ValueError(f"More than {MAX_ZIP_ENTRIES} zip entries")
+    if sum(info.file_size for info in infos) > max_expanded:
+        raise ValueError(f"Expands to more than {max_expanded >> 20} MB")
+
+def _check_upload(upload, max_expanded):
+    """Close a finished Upload and validate it; raises ValueError."""
+    upload.close()
+    if upload.error:
+        raise ValueError(upload.error)
+    _check_zip(upload.path, max_expanded)
+
+def _job_digest(upload_digest, profile=False, options=None):
+    job_options = dict(_job_options())
+    # only options that differ from a form upload's, so both share results
+    job_options.update((k, v) for k, v in (options or {}).items() if v != BOOK_OPTION_DEFAULTS[k])
+    if profile:
+        job_options["profiler"] = PROFILER
+    return hashlib.sha256(f"{upload_digest}\0{json.dumps(job_options, sort_keys=True)}".encode()).hexdigest()
+
+def _submit(tmp_path, filename, upload_digest, profile=False, options=None):
+    """Queue the book saved at tmp_path; returns (job_id, reused)."""
+    digest = _job_digest(upload_digest, profile, options)
+
+    # The same book with the same options: point at the job that already has (or will have) the result
+    existing = _reusable_job(digest)
+    if existing:
+        os.remove(tmp_path)
+        return existing["job_id"], True
+
+    job_id = jobs.create(filename, digest=digest)
+    epub_path = _upload_path(job_id)
+    os.replace(tmp_path, epub_path)
+
+    # Queue on the bounded job pool
+    job_pool.submit(background_task, epub_path, job_id, profile, options)
+    return job_id, False
+
+def _reusable_job(digest):
+    now = time.time()
+    for job in jobs.find_by_digest(digest):
+        if job["status"] == "done":
+            if os.path.exists(job["zip_path"]):
+                return job
+        elif now - job["updated"] < JOB_STALE_SECONDS:
+            return job
+        elif job["status"] == "running":
+            # running jobs report every chapter; this one's worker is gone
+            jobs.update(job["job_id"], status="error", error="Interrupted; please upload the book again.")
+            _remove_files(_upload_path(job["job_id"]))
+    return None
+
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _evict_results(keep=None):
+    """Expire finished jobs older than RESULT_MAX_AGE, then oldest first until under RESULT_MAX_BYTES."""
+    def paths(job):
+        return [p for p in (job["zip_path"], _upload_path(job["job_id"])) if p and os.path.exists(p)]
+
+    done = jobs.done_jobs()
+    sizes = {job["job_id"]: sum(os.path.getsize(p) for p in paths(job)) for job in done}
+    total = sum(sizes.values())
+    now = time.time()
+    for job in done:
+        if job["job_id"] == keep:
+            continue
+        if now - job["updated"] <= RESULT_MAX_AGE and total <= RESULT_MAX_BYTES:
+            continue
+        _remove_files(*paths(job))
+        total -= sizes[job["job_id"]]
+        jobs.update(job["job_id"], status="expired", zip_path=None)
+
+def background_task(epub_path, job_id, profile=False, options=None):
     try:
-        with tempfile.TemporaryDirectory() as extract_dir, tempfile.TemporaryDirectory() as out_dir:
-            with zipfile.ZipFile(epub_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_dir)
-
-            # Run processing
-            report_path = process_folder(
-                Path(extract_dir),
-                Path(out_dir),
-                progress_callback=_update_progress,
-                feature_titles=None,
-                h1_candidates=None
-            )
-
-            # Repack EPUB
+        from reading_core import process_epub
+        options = dict(BOOK_OPTION_DEFAULTS, **(options or {}))
+        jobs.update(job_id, status="running", started=time.time())
+        with tempfile.TemporaryDirectory() as out_dir:
+            # Run processing straight from the upload; patched chapters are streamed
+            # into the new EPUB and everything else is copied without recompression
             patched_epub = os.path.join(out_dir, "patched.epub")
-            with zipfile.ZipFile(patched_epub, 'w') as zip_out:
-                for foldername, _, filenames in os.walk(extract_dir):
-                    for filename in filenames:
-                        file_path = os.path.join(foldername, filename)
-                        rel_path = os.path.relpath(file_path, extract_dir)
-                        zip_out.write(file_path, rel_path)
+            with zipfile.ZipFile(epub_path, 'r') as zin, zipfile.ZipFile(patched_epub, 'w', zipfile.ZIP_DEFLATED) as zout:
+                report_path = process_epub(
+                    zin,
+                    zout,
+                    Path(out_dir),
+                    progress_callback=_progress_callback(job_id),
+                    feature_titles=options["feature_titles"],
+                    h1_candidates=options["h1_candidates"],
+                    patch_enabled=options["patch_enabled"],
+                    backup_enabled=options["backup_enabled"],
+                    insert_after_id=options["insert_after_id"],
+                    workers=PROCESS_WORKERS,
+                    parser_backend=PARSER_BACKEND,
+                    report_format=REPORT_FORMAT,
+                    # Profiled jobs run every chapter through the pipeline (no cached
+                    # results) and get per-stage timing columns and a profile per chapter
+                    result_cache=None if profile else _result_cache(),
+                    stage_timings=profile,
+                    profiler=PROFILER if profile else None
+                )
 
             # Make final ZIP with everything
             final_zip = os.path.join(OUTPUT_FOLDER, f"{job_id}.zip")
             with zipfile.ZipFile(final_zip, 'w') as zipf:
                 zipf.write(patched_epub, "patched.epub")
                 for file in os.listdir(out_dir):
-                    zipf.write(os.path.join(out_dir, file), file)
+                    if file != "patched.epub":
+                        zipf.write(os.path.join(out_dir, file), file)
 
-            progress_status["done"] = True
-            progress_status["zip_path"] = final_zip
+            jobs.update(job_id, status="done", percent=100, zip_path=final_zip)
     except Exception as e:
-        progress_status["error"] = str(e)
+        jobs.update(job_id, status="error", error=str(e))
+        # nothing reuses a failed job, so its upload (and any partial result) can go
+        _remove_files(epub_path, os.path.join(OUTPUT_FOLDER, f"{job_id}.zip"))
+    try:
+        _evict_results(keep=job_id)
+    except Exception:
+        pass
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -62,40 +362,286 @@ def upload():
             flash("Please upload an EPUB file")
             return redirect(request.url)
 
-        job_id = os.path.splitext(file.filename)[0]
-        epub_path = os.path.join(OUTPUT_FOLDER, file.filename)
-        file.save(epub_path)
-
-        # Reset progress
-        progress_status.update({"percent": 0, "done": False, "zip_path": None, "error": None})
-
-        # Start background thread
-        thread = threading.Thread(target=background_task, args=(epub_path, job_id))
-        thread.start()
+        try:
+            _check_upload(file.stream, MAX_EXPANDED_BYTES)
+        except ValueError as e:
+            flash(f"Upload rejected: {e}")
+            return redirect(request.url)
 
-        return redirect(url_for("progress_page"))
+        profile = bool(request.form.get("profile"))
+        job_id, _ = _submit(file.stream.path, file.filename, file.stream.sha256.hexdigest(), profile)
+        return redirect(url_for("progress_page", job_id=job_id))
 
     return render_template_string("""
         <h1>Upload EPUB</h1>
         <form method="post" enctype="multipart/form-data">
             <input type="file" name="file" required>
+            <label><input type="checkbox" name="profile"> Profile</label>
             <button type="submit">Upload</button>
         </form>
     """)
 
 
-@app.route("/progress")
-def progress_page():
-    if progress_status["error"]:
-        return f"❌ Error: {progress_status['error']}"
-    if progress_status["done"]:
+@app.route("/progress/<job_id>")
+def progress_page(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    if job["status"] == "error":
+        return f"❌ Error: {job['error']}"
+    if job["status"] == "done":
         return f"""
             ✅ Processing complete!<br>
-            <a href="{url_for('download_file', filename=os.path.basename(progress_status['zip_path']))}">Download Results ZIP</a>
+            <a href="{url_for('download_file', job_id=job_id)}">Download Results ZIP</a>
         """
-    return f"Processing: {progress_status['percent']}%"
+    if job["status"] == "expired":
+        return "Result expired; please upload the book again."
+    text = "Queued" if job["status"] == "queued" else f"Processing: {job['percent']}%"
+    # Same text as before, kept current from /events (or, when the server has no
+    # stream to spare, by polling the job's status) instead of by reloading the page
+    return render_template_string("""<span id="progress">{{ text }}</span>
+        <script>
+        var el = document.getElementById("progress");
+        // shows a progress payload; true once the job has finished
+        function show(d) {
+            if (d.status === "done") {
+                el.innerHTML = "✅ Processing complete!<br>";
+                var a = el.appendChild(document.createElement("a"));
+                a.href = {{ url_for("download_file", job_id=job_id)|tojson }};
+                a.textContent = "Download Results ZIP";
+            } else if (d.status === "error") {
+                el.textContent = "❌ Error: " + d.error;
+            } else if (d.status === "expired") {
+                el.textContent = "Result expired; please upload the book again.";
+            } else {
+                el.textContent = d.status === "queued" ? "Queued" : "Processing: " + d.percent + "%";
+                return false;
+            }
+            return true;
+        }
+        function poll() {
+            fetch({{ url_for("api_job", job_id=job_id)|tojson }})
+                .then(function (r) { return r.json(); })
+                .then(function (d) { if (!show(d)) setTimeout(poll, 2000); },
+                      function () { setTimeout(poll, 2000); });
+        }
+        var events = new EventSource({{ url_for("progress_events", job_id=job_id)|tojson }});
+        events.addEventListener("progress", function (e) {
+            if (show(JSON.parse(e.data))) events.close();
+        });
+        events.onerror = function () {
+            // refused (503): the browser won't reconnect, so poll instead
+            if (events.readyState === EventSource.CLOSED) poll();
+        };
+        </script>""", text=text, job_id=job_id)
+
+
+@app.route("/events/<job_id>")
+def progress_events(job_id):
+    """Server-Sent Events stream of the job's progress, one "progress" event per change, until it finishes."""
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    if not _stream_slots.acquire(blocking=False):
+        return (jsonify(error="Too many progress streams; poll status_url instead",
+                        status_url=url_for("api_job", job_id=job_id)),
+                503, {"Retry-After": "5"})
+    download_url = url_for("download_file", job_id=job_id)
+
+    def stream():
+        watch = _watch(job)
+        try:
+            yield "retry: 2000\n\n"
+            last, seen = None, -1
+            started = sent = time.monotonic()
+            while time.monotonic() - started < EVENTS_MAX_SECONDS:
+                with _watch_cond:
+                    _watch_cond.wait_for(lambda: watch.version != seen, timeout=15)
+                    current, seen = watch.job, watch.version
+                if current is None:
+                    return
+                state = (current["status"], current["current"], current["total"], current["stage"], current["current_file"])
+                if state != last:
+                    last, sent = state, time.monotonic()
+                    event = _progress_event(current)
+                    if current["status"] == "done":
+                        event["download"] = download_url
+                    yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+                elif time.monotonic() - sent > 15:
+                    # comment line: keeps proxies from closing an idle stream
+                    sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+                if current["status"] in ("done", "error", "expired"):
+                    return
+        finally:
+            _unwatch(job_id)
+
+    response = Response(stream(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(_stream_slots.release)
+    return response
+
+
+@app.route("/download/<job_id>")
+def download_file(job_id):
+    job = jobs.get(job_id)
+    if job is None or job["status"] != "done":
+        abort(404)
+    download_name = os.path.splitext(job["filename"])[0] + ".zip"
+    return send_from_directory(OUTPUT_FOLDER, os.path.basename(job["zip_path"]), as_attachment=True, download_name=download_name)
+
+
+# ---------- Batch API ----------
+# POST /api/jobs takes many books at once: multipart "file" parts (EPUBs, or zips of
+# EPUBs) with an optional "options" JSON field, or a JSON body
+#   {"options": {...}, "epubs": [{"filename": "a.epub", "content": "<base64>"}, ...]}
+# or the raw bytes of one EPUB or zip (Content-Type application/epub+zip or
+# application/zip, ?filename=...&options=...), streamed to disk as it arrives.
+# JSON bodies are limited to MAX_JSON_MB; larger batches go multipart or as a raw zip.
+# Options are BOOK_OPTION_DEFAULTS' keys and apply to every book of the batch. Each
+# book becomes its own job on the job pool; the 202 answer lists one handle per book
+# ("part": its index in the request, "book": its name there; reused: an identical
+# earlier job, whose own upload name is "reused_book") and the parts that were rejected.
+
+def _book_options(raw):
+    """Validated per-book options from the API, only the keys given; raises ValueError."""
+    if raw is None:
+        return {}
+    if not isinstance(raw, dict):
+        raise ValueError("options must be a JSON object")
+    unknown = set(raw) - set(BOOK_OPTION_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}")
+    options = {}
+    for key, value in raw.items():
+        if key in ("feature_titles", "h1_candidates"):
+            if value is not None and not (isinstance(value, list) and all(isinstance(v, str) for v in value)):
+                raise ValueError(f"{key} must be a list of strings")
+            value = value or None
+        elif key in ("patch_enabled", "backup_enabled"):
+            if not isinstance(value, bool):
+                raise ValueError(f"{key} must be true or false")
+        elif not isinstance(value, str) or not value:
+            raise ValueError(f"{key} must be a non-empty string")
+        options[key] = value
+    return options
+
+def _save_books(filename, upload):
+    """Books in one uploaded part, an EPUB or a zip of EPUBs; returns [(filename, tmp_path, sha256)] per book."""
+    if not filename.lower().endswith((".epub", ".zip")):
+        raise ValueError("Not an .epub or .zip file")
+    if filename.lower().endswith(".epub"):
+        _check_upload(upload, MAX_EXPANDED_BYTES)
+        return [(filename, upload.path, upload.sha256.hexdigest())]
+
+    # a zip of EPUBs expands to at most what a request may carry
+    _check_upload(upload, MAX_UPLOAD_BYTES)
+    books = []
+    try:
+        with zipfile.ZipFile(upload.path) as zf:
+            for info in zf.infolist():
+                name = posixpath.basename(info.filename)
+                if info.is_dir() or info.filename.startswith("__MACOSX/") or not name.lower().endswith(".epub"):
+                    continue
+                with zf.open(info) as member:
+                    book = _spool(member, name)
+                try:
+                    _check_upload(book, MAX_EXPANDED_BYTES)
+                except ValueError as e:
+                    raise ValueError(f"{name}: {e}")
+                books.append((name, book.path, book.sha256.hexdigest()))
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, zlib.error, OSError, EOFError, RuntimeError) as e:
+        raise ValueError(f"Unreadable zip: {e}")
+    if not books:
+        raise ValueError("No .epub files in the zip")
+    return books
+
+def _options_field(value):
+    try:
+        return json.loads(value) if value else None
+    except ValueError:
+        raise ValueError('"options" must be JSON')
+
+def _api_parts():
+    """(options, [(filename, Upload or base64 str)]) from a JSON, raw or multipart batch request; raises ValueError."""
+    if request.is_json:
+        request.max_content_length = MAX_JSON_BYTES
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("epubs"), list):
+            raise ValueError('Expected a JSON object with an "epubs" list')
+        parts = []
+        for item in body["epubs"]:
+            if not isinstance(item, dict) or not isinstance(item.get("filename"), str) or not isinstance(item.get("content"), str):
+                raise ValueError('Each of "epubs" needs a "filename" and base64 "content"')
+            parts.append((item["filename"], item["content"]))
+        return _book_options(body.get("options")), parts
+
+    if request.mimetype in ("application/epub+zip", "application/zip"):
+        filename = request.args.get("filename") or ("upload.epub" if request.mimetype == "application/epub+zip" else "upload.zip")
+        options = _book_options(_options_field(request.args.get("options")))
+        return options, [(filename, _spool(request.stream, filename))]
+
+    raw_options = _options_field(request.form.get("options"))
+    files = request.files.getlist("file")
+    if not files:
+        raise ValueError('No "file" parts uploaded')
+    return _book_options(raw_options), [(f.filename or "", f.stream) for f in files]
+
+def _job_handle(job_id, reused=None, part=None, book=None):
+    job = jobs.get(job_id)
+    # "filename" (from the progress event) is the chapter being processed; "book" is the upload
+    handle = {"job_id": job_id, "book": book or job["filename"], **_progress_event(job),
+              "status_url": url_for("api_job", job_id=job_id),
+              "events_url": url_for("progress_events", job_id=job_id)}
+    if part is not None:
+        handle["part"] = part
+    if reused is not None:
+        handle["reused"] = reused
+        if reused:
+            handle["reused_book"] = job["filename"]
+    if job["status"] == "done":
+        handle["download_url"] = url_for("download_file", job_id=job_id)
+    return handle
+
+
+@app.route("/api/jobs", methods=["POST"])
+def api_submit():
+    try:
+        options, parts = _api_parts()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    handles, errors = [], []
+    for part, (filename, data) in enumerate(parts):
+        try:
+            if isinstance(data, str):
+                try:
+                    data = _spool(io.BytesIO(base64.b64decode(data, validate=True)), filename)
+                except binascii.Error:
+                    raise ValueError("content is not valid base64")
+            books = _save_books(filename, data)
+        except ValueError as e:
+            errors.append({"part": part, "filename": filename, "error": str(e)})
+            continue
+        for name, tmp_path, digest in books:
+            job_id, reused = _submit(tmp_path, name, digest, options=options)
+            handles.append(_job_handle(job_id, reused, part, name))
+
+    return jsonify(jobs=handles, errors=errors), 202 if handles else 400
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    if request.path.startswith("/api/"):
+        error = f"Request larger than {request.max_content_length >> 20} MB"
+        if request.is_json:
+            error += "; send large batches as multipart or a raw zip"
+        return jsonify(error=error), 413
+    return e
 
 
-@app.route("/download/<filename>")
-def download_file(filename):
-    return send_from_directory(OUTPUT_FOLDER, filename, as_attachment=True)
+@app.route("/api/jobs/<job_id>")
+def api_job(job_id):
+    if jobs.get(job_id) is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(_job_handle(job_id))
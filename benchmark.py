@@ -0,0 +1,351 @@
+# benchmark.py
+"""
+Reproducible benchmarks for the reading-order pipeline.
+
+    python benchmark.py [--reflow 40] [--fixed 20] [--tables 10] [--scale 1] [--seed 0]
+                        [--repeat 3] [--workers 1] [--parser-backend bs4]
+                        [--targets process_file,process_folder,background_task]
+                        [--epub book.epub] [--json results.json]
+                        [--baseline results.json] [--tolerance 0.25]
+
+Builds a synthetic EPUB (seeded: the same arguments give the same bytes) with the
+shapes reading_core looks for, then times each target in a fresh interpreter and
+reports best-of-N wall time, throughput (pages/s, MB/s of chapter markup) and peak
+RSS. With --baseline, exits non-zero when a target is slower than the baseline by
+more than --tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TARGETS = ("process_file", "process_folder", "background_task")
+
+# Paragraphs with these texts become asides (feature_titles of process_file/process_folder)
+FEATURE_TITLES = ["Did You Know", "Key Point"]
+
+# ---------- Synthetic EPUB ----------
+
+WORDS = ("reading order page layout chapter section question answer option value label "
+         "table column row figure aside note summary detail example result method").split()
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+def _page_number(i):
+    return f"<div class='epub-page-number'>{i}</div>"
+
+def reflow_chapter(rng, i, scale):
+    """Headings, numbered questions with lettered options, bullet runs, feature boxes and a page number."""
+    parts = [f"<h2>Chapter {i}</h2>", f"<p>{_words(rng, 12).capitalize()}.</p>"]
+    for block in range(3 * scale):
+        # a paragraph split across two <p>, joined by ensure_paragraphs_end_with_dot
+        parts.append(f"<p>{_words(rng, 10).capitalize()}</p><p>{_words(rng, 8)}.</p>")
+        for q in range(1, 5):
+            if q % 2:
+                parts.append(f"<p>{q}. {_words(rng, 7).capitalize()}? A. {_words(rng, 2)} B. {_words(rng, 2)}</p>")
+            else:
+                parts.append(f"<p>{q}. {_words(rng, 7).capitalize()}?</p>")
+                parts.extend(f"<p>{letter}) {_words(rng, 3)}</p>" for letter in "ABCD")
+        parts.extend(f"<p>• {_words(rng, 5)}</p>" for _ in range(4))
+        # feature box whose text runs on into the next paragraph (merge_outside_p_after_aside)
+        parts.append(f"<p>{rng.choice(FEATURE_TITLES)}</p><p>{_words(rng, 9).capitalize()}</p><p>{_words(rng, 6)}.</p>")
+        parts.append(f"<figure><img src='img/f{i}.png' alt='{_words(rng, 3)}'/></figure>")
+    parts.append(_page_number(i))
+    return (f"<?xml version='1.0' encoding='utf-8'?>\n<html xmlns='http://www.w3.org/1999/xhtml'>"
+            f"<head><title>Chapter {i}</title></head><body><div id='parent-p1'>{''.join(parts)}</div></body></html>")
+
+# fixed pages alternate between the two CSS-positioned table shapes; one page can't
+# hold both, since every styleid4 span on a page falls into some fact-table row
+FIXED_TABLES = ("comparison_3col", "fact_2col")
+
+def fixed_page(rng, i, scale, table="comparison_3col"):
+    """Absolutely positioned styleid spans: a title, one table of kind table and body lines. Returns (html, css)."""
+    spans, rules = [], []
+
+    def span(cls, text, x, y):
+        key = f"p{i}s{len(spans)}"
+        spans.append(f"<span id='{key}' class='{cls}'>{text}</span>")
+        rules.append(f"#{key} {{ position: absolute; left: {x}px; top: {y}px; }}")
+
+    span("styleid1", _words(rng, 4).title(), 50, 20)
+    y = 100
+    if table == "comparison_3col":
+        for k, head in enumerate(("Item", "Before", "After")):
+            span("styleid4", head, 50 + 220 * k, y)
+        y += 40
+        for r in range(4 * scale):
+            span("styleid4", _words(rng, 2).capitalize(), 50, y)
+            span("styleid5", _words(rng, 2), 270, y)
+            span("styleid5", _words(rng, 2), 490, y + rng.choice((0, 1)))
+            y += 36
+    else:
+        # word labels: numbered ones would be turned into an <ol> instead
+        for r in range(4 * scale):
+            span("styleid3", _words(rng, 1).capitalize(), 50, y)
+            span("styleid4", _words(rng, 3), 300, y)
+            y += 30
+    y += 40
+    for r in range(3 * scale):
+        span("styleid2", _words(rng, 6).capitalize(), 50, y)
+        span("styleid2", _words(rng, 4) + ".", 320, y + 2)
+        y += 28
+    html = (f"<html><head><title>Page {i}</title><link rel='stylesheet' href='css/page{i}.css'/></head>"
+            f"<body><div id='parent-p1'>{''.join(spans)}</div>{_page_number(i)}</body></html>")
+    return html, "\n".join(rules)
+
+def table_chapter(rng, i, scale):
+    """DOM tables (taken by _build_ptable_stream_from_dom), prose and a feature box."""
+    parts = [f"<h2>Tables {i}</h2>", f"<p>{_words(rng, 10).capitalize()}.</p>"]
+    for t in range(2 * scale):
+        rows = "".join(f"<tr><td>{n}</td><td style='color:red'>{_words(rng, 3)}</td><td>{rng.randint(1, 999)}</td></tr>"
+                       for n in range(1, 7))
+        parts.append(f"<table border='1'><tr><th>No</th><th>Name</th><th>Value</th></tr>{rows}</table>")
+        parts.append(f"<p>{FEATURE_TITLES[0]}</p><p>{_words(rng, 8).capitalize()}</p><p>{_words(rng, 5)}.</p>")
+    parts.append(_page_number(i))
+    return f"<html><head><title>Tables {i}</title></head><body><div id='parent-p1'>{''.join(parts)}</div></body></html>"
+
+def make_epub(path, reflow=40, fixed=20, tables=10, scale=1, seed=0):
+    """Write the synthetic book to path; returns (number of spine documents, their total bytes)."""
+    rng = random.Random(seed)
+    docs, extra = [], []
+    kinds = ["reflow"] * reflow + ["fixed"] * fixed + ["tables"] * tables
+    rng.shuffle(kinds)
+    for n, kind in enumerate(kinds, start=1):
+        if kind == "reflow":
+            docs.append((f"text/chapter{n:04d}.xhtml", reflow_chapter(rng, n, scale)))
+        elif kind == "tables":
+            docs.append((f"text/tables{n:04d}.xhtml", table_chapter(rng, n, scale)))
+        else:
+            html, css = fixed_page(rng, n, scale, FIXED_TABLES[len(extra) % len(FIXED_TABLES)])
+            docs.append((f"text/page{n:04d}.xhtml", html))
+            extra.append((f"text/css/page{n}.css", css))
+
+    manifest = "".join(f"<item id='d{k}' href='{name}' media-type='application/xhtml+xml'/>" for k, (name, _) in enumerate(docs))
+    manifest += "".join(f"<item id='c{k}' href='{name}' media-type='text/css'/>" for k, (name, _) in enumerate(extra))
+    spine = "".join(f"<itemref idref='d{k}'/>" for k in range(len(docs)))
+    opf = (f"<?xml version='1.0' encoding='utf-8'?><package xmlns='http://www.idpf.org/2007/opf' version='3.0'>"
+           f"<manifest>{manifest}</manifest><spine>{spine}</spine></package>")
+    container = ("<?xml version='1.0'?><container version='1.0' xmlns='urn:oasis:names:tc:opendocument:xmlns:container'>"
+                 "<rootfiles><rootfile full-path='OEBPS/content.opf' media-type='application/oebps-package+xml'/></rootfiles></container>")
+
+    def info(name):
+        # fixed timestamps keep the archive bytes reproducible
+        return zipfile.ZipInfo(name, date_time=(2020, 1, 1, 0, 0, 0))
+
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr(info("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        z.writestr(info("META-INF/container.xml"), container, compress_type=zipfile.ZIP_DEFLATED)
+        z.writestr(info("OEBPS/content.opf"), opf, compress_type=zipfile.ZIP_DEFLATED)
+        for name, data in docs + extra:
+            z.writestr(info(f"OEBPS/{name}"), data, compress_type=zipfile.ZIP_DEFLATED)
+    return len(docs), sum(len(data.encode("utf-8")) for _, data in docs)
+
+def detected_tables(path):
+    """{table kind: pages} as reading_core's CSS table detectors see the book's fixed pages."""
+    sys.path.insert(0, HERE)
+    from reading_core import collect_token_table, detect_comparison_table_columnar, detect_fact_table_columnar
+    counts = dict.fromkeys(FIXED_TABLES, 0)
+    with zipfile.ZipFile(path) as z:
+        for name in z.namelist():
+            match = re.fullmatch(r"OEBPS/text/page(\d+)\.xhtml", name)
+            if not match:
+                continue
+            css = z.read(f"OEBPS/text/css/page{int(match.group(1))}.css").decode("utf-8")
+            tokens = collect_token_table(z.read(name).decode("utf-8"), css)
+            for detect in (detect_comparison_table_columnar, detect_fact_table_columnar):
+                block = detect(tokens)
+                if block:
+                    counts[block["kind"]] += 1
+    return counts
+
+# ---------- Targets (each run in a fresh interpreter) ----------
+
+def _peak_rss_mb(who):
+    rss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024
+
+def _extract(epub, dest):
+    shutil.rmtree(dest, ignore_errors=True)
+    with zipfile.ZipFile(epub) as z:
+        z.extractall(dest)
+    return Path(dest)
+
+def _run_process_file(spec, work):
+    from reading_core import process_file, _collect_files
+    times = []
+    for _ in range(spec["repeat"]):
+        src = _extract(spec["epub"], work / "in")
+        files = _collect_files(src)
+        start = time.perf_counter()
+        for fp in files:
+            process_file(fp, work / "out", feature_titles=FEATURE_TITLES, parser_backend=spec["parser_backend"])
+        times.append(time.perf_counter() - start)
+    return times
+
+def _run_process_folder(spec, work):
+    from reading_core import process_folder
+    times = []
+    for _ in range(spec["repeat"]):
+        src = _extract(spec["epub"], work / "in")
+        start = time.perf_counter()
+        process_folder(src, work / "out", feature_titles=FEATURE_TITLES, workers=spec["workers"],
+                       parser_backend=spec["parser_backend"])
+        times.append(time.perf_counter() - start)
+    return times
+
+def _run_background_task(spec, work):
+    # app keeps its outputs, job store and chapter cache relative to the working directory.
+    # It runs with its own options (no feature titles), like a real upload.
+    os.chdir(work)
+    os.environ.update(PROCESS_WORKERS=str(spec["workers"]), PARSER_BACKEND=spec["parser_backend"],
+                      RESULT_CACHE_DIR=str(work / "chapter-cache"))
+    import app
+    times = []
+    for _ in range(spec["repeat"]):
+        shutil.rmtree(work / "chapter-cache", ignore_errors=True)
+        job_id = app.jobs.create("bench.epub")
+        epub_path = app._upload_path(job_id)
+        shutil.copyfile(spec["epub"], epub_path)
+        start = time.perf_counter()
+        app.background_task(epub_path, job_id)
+        times.append(time.perf_counter() - start)
+        job = app.jobs.get(job_id)
+        if job["status"] != "done":
+            raise RuntimeError(f"background_task failed: {job['error']}")
+    return times
+
+def _pool_workers_peak_rss_mb():
+    # pool workers are forked by the forkserver, not by us, so RUSAGE_CHILDREN never
+    # counts them; read each live worker's high-water mark instead (Linux only)
+    peak = 0.0
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmHWM:"):
+                        peak = max(peak, int(line.split()[1]) / 1024)
+        except OSError:
+            pass
+    return peak
+
+def _stop_pool():
+    reading_core = sys.modules.get("reading_core")
+    if reading_core is not None and reading_core._pool is not None:
+        reading_core._drop_process_pool(reading_core._pool, wait=True)
+
+def run_target(target, spec):
+    sys.path.insert(0, HERE)
+    with tempfile.TemporaryDirectory() as work:
+        times = globals()[f"_run_{target}"](spec, Path(work))
+    child_rss_mb = max(_peak_rss_mb(resource.RUSAGE_CHILDREN), _pool_workers_peak_rss_mb())
+    _stop_pool()
+    return {"times": times, "rss_mb": _peak_rss_mb(resource.RUSAGE_SELF), "child_rss_mb": child_rss_mb}
+
+# ---------- Driver ----------
+
+def _summary(target, raw, pages, nbytes):
+    best = min(raw["times"])
+    return {
+        "target": target,
+        "best_s": best,
+        "times_s": raw["times"],
+        "pages_per_s": pages / best if best else 0.0,
+        "mb_per_s": nbytes / (1 << 20) / best if best else 0.0,
+        "peak_rss_mb": raw["rss_mb"],
+        "peak_child_rss_mb": raw["child_rss_mb"],
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--reflow", type=int, default=40, help="reflowable chapters with question lists")
+    ap.add_argument("--fixed", type=int, default=20, help="fixed-layout pages with positioned styleid spans")
+    ap.add_argument("--tables", type=int, default=10, help="chapters with DOM tables")
+    ap.add_argument("--scale", type=int, default=1, help="content blocks per document")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--parser-backend", default="bs4")
+    ap.add_argument("--targets", default=",".join(TARGETS))
+    ap.add_argument("--epub", help="also keep the generated book at this path")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--baseline", help="results file of an earlier run to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--run", help=argparse.SUPPRESS)
+    ap.add_argument("--spec", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.run:
+        print(json.dumps(run_target(args.run, json.loads(args.spec))))
+        return 0
+
+    targets = [t for t in args.targets.split(",") if t]
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        ap.error(f"unknown targets: {', '.join(sorted(unknown))}")
+
+    config = {"reflow": args.reflow, "fixed": args.fixed, "tables": args.tables, "scale": args.scale,
+              "seed": args.seed, "workers": args.workers, "parser_backend": args.parser_backend}
+    with tempfile.TemporaryDirectory() as tmp:
+        epub = os.path.join(tmp, "bench.epub")
+        pages, nbytes = make_epub(epub, args.reflow, args.fixed, args.tables, args.scale, args.seed)
+        if args.epub:
+            shutil.copyfile(epub, args.epub)
+        print(f"{pages} pages, {nbytes / (1 << 20):.2f} MB of chapter markup, best of {args.repeat}")
+        # the fixed pages are only worth timing if the detectors find their tables
+        tables = detected_tables(epub)
+        missing = [kind for kind in FIXED_TABLES[:args.fixed] if not tables[kind]]
+        if missing:
+            print(f"generator self-check failed: no {', '.join(missing)} detected ({tables})", file=sys.stderr)
+            return 3
+
+        spec = dict(config, epub=epub, repeat=args.repeat)
+        results = []
+        for target in targets:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", target, "--spec", json.dumps(spec)],
+                                 capture_output=True, text=True)
+            if out.returncode:
+                sys.stderr.write(out.stderr)
+                return out.returncode
+            result = _summary(target, json.loads(out.stdout.strip().splitlines()[-1]), pages, nbytes)
+            results.append(result)
+            print(f"{target:<16} {result['best_s']:8.3f} s  {result['pages_per_s']:8.1f} pages/s  "
+                  f"{result['mb_per_s']:6.2f} MB/s  peak RSS {result['peak_rss_mb']:.0f} MB"
+                  + (f" (workers {result['peak_child_rss_mb']:.0f} MB)" if result["peak_child_rss_mb"] else ""))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"config": config, "results": results}, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if baseline.get("config") != config:
+            print("baseline was run with a different configuration; not comparing")
+            return 2
+        before = {r["target"]: r["best_s"] for r in baseline["results"]}
+        regressed = False
+        for r in results:
+            if r["target"] not in before:
+                continue
+            change = r["best_s"] / before[r["target"]] - 1
+            slower = change > args.tolerance
+            regressed = regressed or slower
+            print(f"{r['target']:<16} {change:+7.1%} vs baseline{'  REGRESSION' if slower else ''}")
+        return 1 if regressed else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
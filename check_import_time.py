@@ -0,0 +1,65 @@
+# check_import_time.py
+"""
+Cold-start import budget for the web workers.
+
+    python check_import_time.py [--runs 5] [--app-ms 400] [--core-ms 500]
+
+Imports app and reading_core, each in fresh interpreters, and takes the best wall
+time of --runs. Exits non-zero when a module goes over its budget or loads a
+dependency that is supposed to be imported lazily.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# module -> dependencies it must not import by itself
+LAZY = {
+    "app": ("reading_core", "bs4", "lxml", "numpy", "cssutils", "openpyxl", "pandas"),
+    "reading_core": ("cssutils", "openpyxl", "pandas", "concurrent.futures.process"),
+}
+
+PROBE = """
+import json, sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+def measure(module, runs):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    best, loaded = None, []
+    # app creates outputs/ and its job store relative to the working directory
+    with tempfile.TemporaryDirectory() as cwd:
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", PROBE.format(module=module, lazy=LAZY[module])],
+                                 cwd=cwd, env=env, capture_output=True, text=True, check=True)
+            probe = json.loads(out.stdout.strip().splitlines()[-1])
+            best = probe["ms"] if best is None else min(best, probe["ms"])
+            loaded = probe["loaded"]
+    return best, loaded
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--app-ms", type=float, default=400.0)
+    ap.add_argument("--core-ms", type=float, default=500.0)
+    args = ap.parse_args()
+
+    ok = True
+    for module, budget in (("app", args.app_ms), ("reading_core", args.core_ms)):
+        ms, loaded = measure(module, args.runs)
+        status = "ok" if ms <= budget and not loaded else "FAIL"
+        ok = ok and status == "ok"
+        print(f"{module:<13} {ms:7.1f} ms  (budget {budget:.0f} ms)  {status}")
+        if loaded:
+            print(f"  loaded eagerly: {', '.join(loaded)}")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
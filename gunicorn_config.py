@@ -1 +1,9 @@
+import os
+
 timeout = 180
+# /events keeps a connection open per watching browser; threaded workers hold those
+# streams on threads instead of tying up a whole worker process each. app.py caps them
+# at EVENTS_MAX_STREAMS per process (keep it below GUNICORN_THREADS); pages beyond
+# that poll the job's status instead.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
@@ -0,0 +1,96 @@
+# jobs.py
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from typing import Any, Dict, List, Optional
+
+# ---------- Job store ----------
+# One row per upload in a local SQLite file, so every thread and every gunicorn
+# worker on the host sees the same progress/result state.
+
+JOB_COLUMNS = ("job_id", "filename", "status", "percent", "stage", "current_file", "zip_path", "error", "digest",
+               "current", "total", "started", "created", "updated")
+
+# Columns added after the first release, created on stores that predate them
+_ADDED_COLUMNS = {"digest": "TEXT", "current": "INTEGER", "total": "INTEGER", "started": "REAL"}
+
+class JobStore:
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    filename TEXT,
+                    status TEXT NOT NULL,
+                    percent INTEGER NOT NULL DEFAULT 0,
+                    stage TEXT,
+                    current_file TEXT,
+                    zip_path TEXT,
+                    error TEXT,
+                    digest TEXT,
+                    current INTEGER,
+                    total INTEGER,
+                    started REAL,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )""")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, decl in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {decl}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_digest ON jobs (digest)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, filename: str, digest: Optional[str] = None) -> str:
+        """Register a queued job and return its id. digest identifies the input + options."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, filename, status, digest, created, updated) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, filename, digest, now, now))
+        return job_id
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        unknown = set(fields) - set(JOB_COLUMNS[1:-2])
+        if unknown:
+            raise ValueError(f"Unknown job fields: {sorted(unknown)}")
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_many(self, job_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Rows of the given jobs that exist, by job_id, read in one query."""
+        if not job_ids:
+            return {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT * FROM jobs WHERE job_id IN ({', '.join('?' * len(job_ids))})",
+                                list(job_ids)).fetchall()
+        return {row["job_id"]: dict(row) for row in rows}
+
+    def find_by_digest(self, digest: str) -> List[Dict[str, Any]]:
+        """Live jobs (queued, running or done) for digest, newest first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE digest = ? AND status IN ('queued', 'running', 'done') ORDER BY created DESC",
+                (digest,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def done_jobs(self) -> List[Dict[str, Any]]:
+        """Finished jobs whose results are still kept, least recently finished first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = 'done' ORDER BY updated").fetchall()
+        return [dict(row) for row in rows]
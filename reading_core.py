@@ -1,14 +1,33 @@
 # reading_core.py
+import copy
+import csv
+import functools
+import hashlib
+import importlib.util
+import itertools
+import json
+import os
+import posixpath
 import re
 import shutil
+import struct
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from statistics import median
 from pathlib import Path
-from typing import Any, List, Optional, Dict, Callable, Tuple
+from typing import Any, List, Optional, Dict, Callable, ContextManager, Iterator, Tuple, Union
 from html import escape as html_escape
+from urllib.parse import unquote
 import html as ihtml
 
-from bs4 import BeautifulSoup, NavigableString, Comment
-
-import pandas as pd
+from bs4 import BeautifulSoup, NavigableString, Comment, Tag
+from bs4.element import PreformattedString
+import lxml.etree
+import lxml.html
+import numpy as np
 
 # ----------------- Helpers -----------------
 
@@ -27,13 +46,201 @@ def _is_ignorable_media_node(node: Any) -> bool:
             return True
     return False
 
+class TextCache:
+    """
+    Memoized get_text() results for the nodes of one tree, shared by the post-processing
+    stages. Entries are keyed by node identity (the node is pinned by its entry) and must
+    be dropped with invalidate() when a subtree changes; append() moves children under a
+    node and extends the node's cached text instead of re-reading it.
+    """
+
+    def __init__(self) -> None:
+        self._entries: Dict[int, Tuple[Any, Dict[Tuple[str, bool], str]]] = {}
+
+    def get(self, node: Any, separator: str = "", strip: bool = False) -> str:
+        entry = self._entries.get(id(node))
+        if entry is None:
+            entry = self._entries[id(node)] = (node, {})
+        texts = entry[1]
+        text = texts.get((separator, strip))
+        if text is None:
+            text = texts[(separator, strip)] = node.get_text(separator, strip=strip)
+        return text
+
+    def invalidate(self, node: Any) -> None:
+        # an ancestor's text contains this node's, so the whole chain goes
+        while node is not None:
+            self._entries.pop(id(node), None)
+            node = node.parent
+
+    def append(self, node: Tag, children: List[Any]) -> None:
+        """node.append() each child, keeping node's cached text current."""
+        for child in children:
+            if child.parent is not None:
+                self.invalidate(child.parent)
+        self.invalidate(node.parent)
+
+        entry = self._entries.get(id(node))
+        if entry is not None:
+            types = node.interesting_string_types or Tag.MAIN_CONTENT_STRING_TYPES
+            texts = entry[1]
+            for (separator, strip), text in list(texts.items()):
+                if separator and not strip:
+                    # empty strings still get a separator here, so this one is not additive
+                    del texts[(separator, strip)]
+                    continue
+                for child in children:
+                    piece = child.get_text(separator, strip=strip, types=types)
+                    text = f"{text}{separator}{piece}" if (text and piece) else (text or piece)
+                texts[(separator, strip)] = text
+
+        for child in children:
+            node.append(child)
+
+_ASCII_SPACES = frozenset("\x20\x0a\x09\x0c\x0d")
+_PRESERVE_WHITESPACE_TAGS = ("pre", "textarea")
+
+def _settle_whitespace(soup: Any, texts: Optional[TextCache] = None) -> Any:
+    """
+    Leave text nodes the way html.parser does after a parse: each run of adjacent
+    strings merged into one, empty ones dropped, and whitespace-only ones folded to
+    "\n" or " " (except inside <pre>/<textarea>). The *_tree stages call this before
+    returning, so chaining them on one live tree serializes exactly like the old
+    parse -> str() -> parse round trips, and later stages read the same texts.
+    """
+    def settle(run: List[NavigableString], preserve: bool) -> None:
+        if not run:
+            return
+        text = "".join(run)
+        if text and not preserve and all(ch in _ASCII_SPACES for ch in text):
+            text = "\n" if "\n" in text else " "
+        if len(run) == 1 and str(run[0]) == text:
+            return
+        if texts is not None:
+            texts.invalidate(run[0].parent)
+        if text:
+            run[0].replace_with(type(run[0])(text))
+        else:
+            run[0].extract()
+        for extra in run[1:]:
+            extra.extract()
+
+    def walk(node: Any, preserve: bool) -> None:
+        run: List[NavigableString] = []
+        for child in list(node.contents):
+            if isinstance(child, NavigableString) and not isinstance(child, PreformattedString):
+                run.append(child)
+                continue
+            settle(run, preserve)
+            run = []
+            if isinstance(child, Tag):
+                walk(child, preserve or child.name in _PRESERVE_WHITESPACE_TAGS)
+        settle(run, preserve)
+
+    walk(soup, False)
+    return soup
+
+# ---------- Parser backends ----------
+# "bs4":  BeautifulSoup everywhere - html.parser for chapter documents, the lxml
+#         builder for the CSS token walk. This is the reference behaviour.
+# "lxml": chapter documents go through lxml's C parser (via BeautifulSoup's lxml
+#         builder, so the document stages are shared), and the CSS token walk
+#         runs natively on lxml.html without building a BeautifulSoup tree.
+#         libxml2 repairs malformed markup differently from html.parser (unclosed
+#         <p>, a <table> inside <p>, content before <body>), so a chapter only keeps
+#         the lxml tree when it is well-formed XML and lxml built the same element
+#         outline; anything else is parsed with html.parser as under "bs4".
+#         That check costs parses: every chapter is first parsed as XML (a failed
+#         attempt on non-XML markup is cheap, a few percent of an html.parser parse),
+#         and a well-formed chapter whose lxml outline differs is parsed a third time
+#         by html.parser. Building the BeautifulSoup tree dominates either way, so the
+#         document parse itself is about as fast as under "bs4"; what "lxml" saves is
+#         mostly the native CSS token walk.
+PARSER_BACKENDS = ("bs4", "lxml")
+DEFAULT_PARSER_BACKEND = "bs4"
+
+def parse_document(html_src: str, parser_backend: str = DEFAULT_PARSER_BACKEND) -> BeautifulSoup:
+    if parser_backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend {parser_backend!r}; expected one of {PARSER_BACKENDS}")
+    if parser_backend == "lxml":
+        outline = _xml_outline(html_src or "")
+        if outline is not None:
+            soup = BeautifulSoup(html_src, "lxml")
+            if _soup_outline(soup, []) == outline:
+                return soup
+    return BeautifulSoup(html_src or "", "html.parser")
+
+def _xml_outline(html_src: str) -> Optional[List[Optional[str]]]:
+    """Element names in document order (None closes one) as html.parser would nest them; None unless well-formed XML."""
+    try:
+        root = lxml.etree.fromstring(html_src.encode("utf-8"), lxml.etree.XMLParser(resolve_entities=False, no_network=True))
+    except (lxml.etree.XMLSyntaxError, ValueError):
+        return None
+    outline: List[Optional[str]] = []
+    for event, el in lxml.etree.iterwalk(root, events=("start", "end")):
+        if not isinstance(el.tag, str):
+            continue
+        if event == "end":
+            outline.append(None)
+        else:
+            name = lxml.etree.QName(el).localname
+            outline.append((f"{el.prefix}:{name}" if el.prefix else name).lower())
+    return outline
+
+def _soup_outline(node: Tag, outline: List[Optional[str]]) -> List[Optional[str]]:
+    for child in node.children:
+        if isinstance(child, Tag):
+            outline.append(child.name)
+            _soup_outline(child, outline)
+            outline.append(None)
+    return outline
+
+def _parse_lxml_native(html_str: str) -> Any:
+    return lxml.html.document_fromstring(html_str.encode("utf-8"), parser=lxml.html.HTMLParser(encoding="utf-8"))
+
+def _iter_named(tree: Any, name: str):
+    # works for both BeautifulSoup trees and lxml.html elements
+    if isinstance(tree, Tag):
+        return tree.find_all(name)
+    return tree.iter(name)
+
+# bs4's get_text() leaves out what these hold (unless asked for the element itself),
+# as well as comments and processing instructions
+_NON_TEXT_TAGS = ("script", "style", "template")
+
+def _lxml_texts(el: Any) -> Iterator[str]:
+    if el.tag in _NON_TEXT_TAGS:
+        yield from el.itertext()
+        return
+    def walk(node: Any) -> Iterator[str]:
+        if node.text:
+            yield node.text
+        for child in node:
+            if isinstance(child.tag, str) and child.tag not in _NON_TEXT_TAGS:
+                yield from walk(child)
+            if child.tail:
+                yield child.tail
+    yield from walk(el)
+
+def _node_text(el: Any, strip: bool = False) -> str:
+    # same result as bs4's el.get_text() / el.get_text(strip=True) for either tree type
+    if isinstance(el, Tag):
+        return el.get_text(strip=strip)
+    if strip:
+        return "".join(t.strip() for t in _lxml_texts(el))
+    return "".join(_lxml_texts(el))
+
 # ---------- Paragraph & aside merging ----------
 
 def merge_outside_p_after_aside(html_fragment: str) -> str:
-    soup = BeautifulSoup(html_fragment, 'html.parser')
+    return str(merge_outside_p_after_aside_tree(BeautifulSoup(html_fragment, 'html.parser')))
+
+
+def merge_outside_p_after_aside_tree(soup: BeautifulSoup, texts: Optional[TextCache] = None) -> BeautifulSoup:
+    texts = TextCache() if texts is None else texts
 
     def ends_with_dot(el: Any) -> bool:
-        txt = el.get_text(strip=True)
+        txt = texts.get(el, strip=True)
         return bool(txt) and txt.endswith(".")
 
     for aside in soup.find_all("aside"):
@@ -47,27 +254,32 @@ def merge_outside_p_after_aside(html_fragment: str) -> str:
             while sib and _is_ignorable_media_node(sib):
                 sib = sib.next_sibling
             if sib and getattr(sib, "name", "").lower() == "p":
-                current_text = last_p.get_text()
+                current_text = texts.get(last_p)
+                moved = []
                 if current_text and not current_text.endswith((" ", "\n", "\t")):
-                    last_p.append(NavigableString(" "))
-                for child in list(sib.contents):
-                    last_p.append(child)
+                    moved.append(NavigableString(" "))
+                texts.append(last_p, moved + list(sib.contents))
+                texts.invalidate(sib)
                 sib.extract()
             else:
                 break
 
-    return str(soup)
+    return _settle_whitespace(soup, texts)
 
 
 def ensure_paragraphs_end_with_dot(html_fragment: str) -> str:
-    soup = BeautifulSoup(html_fragment, 'html.parser')
+    return str(ensure_paragraphs_end_with_dot_tree(BeautifulSoup(html_fragment, 'html.parser')))
+
+
+def ensure_paragraphs_end_with_dot_tree(soup: BeautifulSoup, texts: Optional[TextCache] = None) -> BeautifulSoup:
+    texts = TextCache() if texts is None else texts
 
     def ends_with_dot(el: Any) -> bool:
-        txt = el.get_text(strip=True)
+        txt = texts.get(el, strip=True)
         return bool(txt) and txt.endswith(".")
 
     def first_word_has_uppercase(el: Any) -> bool:
-        txt = el.get_text(" ", strip=True)
+        txt = texts.get(el, " ", strip=True)
         if not txt:
             return False
         trimmed = re.sub(r'^[\s\W_]+', '', txt, flags=re.UNICODE)
@@ -90,14 +302,15 @@ def ensure_paragraphs_end_with_dot(html_fragment: str) -> str:
                 break
             if first_word_has_uppercase(sib):
                 break
-            current_text = p.get_text()
+            current_text = texts.get(p)
+            moved = []
             if current_text and not current_text.endswith((" ", "\n", "\t")):
-                p.append(NavigableString(" "))
-            for child in list(sib.contents):
-                p.append(child)
+                moved.append(NavigableString(" "))
+            texts.append(p, moved + list(sib.contents))
+            texts.invalidate(sib)
             sib.decompose()
 
-    return str(soup)
+    return _settle_whitespace(soup, texts)
 
 
 # ---------- List detection (converted from original) ----------
@@ -110,97 +323,83 @@ bullet_pat = re.compile(r'^\s*(?:[' + bullet_chars + r'])\s+(.*)$')
 inline_letter_split_pat = re.compile(r'(?:^|\s)([A-Z])[.)]\s+')
 
 def convert_paragraphs_to_lists(html_fragment: str, min_items: int = 2) -> str:
-    soup = BeautifulSoup(html_fragment, 'html.parser')
-
-    def split_inline_letter_opts(text: str):
-        matches = list(inline_letter_split_pat.finditer(text))
-        if not matches:
-            return text.strip(), []
-        q_text = text[:matches[0].start()].strip()
-        options = []
-        for idx, m in enumerate(matches):
-            start = m.end()
-            end = matches[idx + 1].start() if idx + 1 < len(matches) else len(text)
-            opt = text[start:end].strip()
-            if opt:
-                options.append(opt)
-        return q_text, options
-
-    def is_p(el: Any) -> bool:
-        return hasattr(el, "name") and el.name == "p"
-
-    def process_parent_for_numbered_with_nested(parent):
-        children = list(parent.children)
+    return str(convert_paragraphs_to_lists_tree(BeautifulSoup(html_fragment, 'html.parser'), min_items=min_items))
+
+
+def _split_inline_letter_opts(text: str) -> Tuple[str, List[str]]:
+    matches = list(inline_letter_split_pat.finditer(text))
+    if not matches:
+        return text.strip(), []
+    q_text = text[:matches[0].start()].strip()
+    options = []
+    for idx, m in enumerate(matches):
+        start = m.end()
+        end = matches[idx + 1].start() if idx + 1 < len(matches) else len(text)
+        opt = text[start:end].strip()
+        if opt:
+            options.append(opt)
+    return q_text, options
+
+
+def _list_marker(el: Any, texts: TextCache) -> Tuple[Optional[str], Optional[str]]:
+    """("num" | "letter" | "bullet", item text) for a <p> with a list marker, else (None, None)."""
+    if getattr(el, "name", None) != "p":
+        return None, None
+    t = texts.get(el, " ", strip=True)
+    m = num_pat.match(t)
+    if m:
+        return "num", m.group(2)
+    m = bullet_pat.match(t)
+    if m:
+        return "bullet", m.group(1)
+    m = letter_pat.match(t)
+    if m:
+        return "letter", m.group(2)
+    return None, None
+
+
+def convert_paragraphs_to_lists_tree(soup: BeautifulSoup, min_items: int = 2, texts: Optional[TextCache] = None) -> BeautifulSoup:
+    # Runs are made of adjacent <p> siblings, so only elements with <p> children can hold one.
+    # Each parent's children are snapshotted and classified once; both passes walk that
+    # snapshot by index, so no sibling list is rebuilt and no paragraph text is re-read.
+    parents = [el for el in itertools.chain((soup,), soup.descendants)
+               if isinstance(el, Tag) and any(getattr(c, "name", None) == "p" for c in el.contents)]
+
+    texts = TextCache() if texts is None else texts
+
+    def replace_run(run: List[Any], new_list: Tag) -> None:
+        texts.invalidate(run[0].parent)
+        run[0].insert_before(new_list)
+        for n in run:
+            n.extract()
+
+    for parent in parents:
+        children = list(parent.contents)
+        markers = [_list_marker(c, texts) for c in children]
+        n = len(children)
+
+        # Pass 1: numbered items, each followed by optional lettered option paragraphs
         i = 0
-        while i < len(children):
-            el = children[i]
-            if not is_p(el):
-                i += 1
-                continue
-
-            txt = el.get_text(" ", strip=True)
-            m = num_pat.match(txt)
-            if not m:
+        while i < n:
+            if markers[i][0] != "num":
                 i += 1
                 continue
-
             items = []
-            consumed = []
             pos = i
-            while pos < len(children):
-                node = children[pos]
-                if not is_p(node):
-                    break
-                t = node.get_text(" ", strip=True)
-                mnum = num_pat.match(t)
-                if not mnum:
-                    break
-
-                q_full = mnum.group(2)
-                q_text, inline_opts = split_inline_letter_opts(q_full)
-
-                opt_nodes = []
-                opt_texts = []
+            while pos < n and markers[pos][0] == "num":
+                q_text, inline_opts = _split_inline_letter_opts(markers[pos][1])
                 k = pos + 1
-                while k < len(children):
-                    nodek = children[k]
-                    if not is_p(nodek):
-                        break
-                    tk = nodek.get_text(" ", strip=True)
-                    if num_pat.match(tk):
-                        break  # next numbered item
-                    mletter = letter_pat.match(tk)
-                    if mletter:
-                        opt_nodes.append(nodek)
-                        opt_texts.append(mletter.group(2))
-                        k += 1
-                        continue
-                    break
-
-                items.append({
-                    "p_node": node,
-                    "q_text": q_text,
-                    "inline_opts": inline_opts,
-                    "opt_nodes": opt_nodes,
-                    "opt_texts": opt_texts,
-                })
-                consumed.append(node)
-                consumed.extend(opt_nodes)
-
-                if k < len(children) and is_p(children[k]) and num_pat.match(children[k].get_text(" ", strip=True)):
-                    pos = k
-                    continue
-                else:
-                    pos = k
-                    break
+                while k < n and markers[k][0] == "letter":
+                    k += 1
+                items.append((q_text, inline_opts + [t for _, t in markers[pos+1:k]]))
+                pos = k
 
             if len(items) >= min_items:
                 new_ol = soup.new_tag("ol")
                 new_ol["class"] = ["text-hidden"]
-                for it in items:
+                for q_text, all_opts in items:
                     li = soup.new_tag("li")
-                    li.append(NavigableString(it["q_text"]))
-                    all_opts = list(it["inline_opts"]) + list(it["opt_texts"])
+                    li.append(NavigableString(q_text))
                     if all_opts:
                         inner = soup.new_tag("ol")
                         inner["type"] = "A"
@@ -210,120 +409,64 @@ def convert_paragraphs_to_lists(html_fragment: str, min_items: int = 2) -> str:
                             inner.append(li2)
                         li.append(inner)
                     new_ol.append(li)
-
-                el.insert_before(new_ol)
-                for n in consumed:
-                    n.extract()
-
-                children = list(parent.children)
-                try:
-                    i = children.index(new_ol) + 1
-                except ValueError:
-                    i += 1
+                replace_run(children[i:pos], new_ol)
+                # converted paragraphs now act as a non-paragraph gap for pass 2
+                markers[i:pos] = [(None, None)] * (pos - i)
+                i = pos
             else:
                 i += 1
 
-    def process_parent_simple_runs(parent):
-        children = list(parent.children)
+        # Pass 2: plain runs of numbered, bulleted or lettered paragraphs
         i = 0
-        while i < len(children):
-            el = children[i]
-            if not is_p(el):
+        while i < n:
+            kind = markers[i][0]
+            if kind is None:
                 i += 1
                 continue
-
-            t = el.get_text(" ", strip=True)
-            list_type = None
-            is_letter_run = False
-            first_text = None
-
-            mnum = num_pat.match(t)
-            mbullet = bullet_pat.match(t)
-            mletter = letter_pat.match(t)
-
-            if mnum:
-                list_type = "ol"
-                first_text = mnum.group(2)
-            elif mbullet:
-                list_type = "ul"
-                first_text = mbullet.group(1)
-            elif mletter:
-                list_type = "ol"
-                is_letter_run = True
-                first_text = mletter.group(2)
-
-            if not list_type:
-                i += 1
-                continue
-
-            run = [(el, first_text)]
             j = i + 1
-            while j < len(children):
-                el2 = children[j]
-                if not is_p(el2):
-                    break
-                t2 = el2.get_text(" ", strip=True)
-                if list_type == "ol" and not is_letter_run:
-                    m2 = num_pat.match(t2)
-                    if not m2:
-                        break
-                    run.append((el2, m2.group(2)))
-                elif list_type == "ol" and is_letter_run:
-                    l2 = letter_pat.match(t2)
-                    if not l2:
-                        break
-                    run.append((el2, l2.group(2)))
-                else:
-                    b2 = bullet_pat.match(t2)
-                    if not b2:
-                        break
-                    run.append((el2, b2.group(1)))
+            while j < n and markers[j][0] == kind:
                 j += 1
 
-            if len(run) >= min_items:
-                new_list = soup.new_tag(list_type)
+            if j - i >= min_items:
+                new_list = soup.new_tag("ul" if kind == "bullet" else "ol")
                 new_list["class"] = ["text-hidden"]
-                if list_type == "ol" and is_letter_run:
+                if kind == "letter":
                     new_list["type"] = "A"
-                for _, item_text in run:
+                for _, item_text in markers[i:j]:
                     li = soup.new_tag("li")
                     li.string = item_text
                     new_list.append(li)
-                run[0][0].insert_before(new_list)
-                for p_el, _ in run:
-                    p_el.extract()
-                children = list(parent.children)
-                try:
-                    i = children.index(new_list) + 1
-                except ValueError:
-                    i += 1
+                replace_run(children[i:j], new_list)
+                i = j
             else:
                 i += 1
 
-    for parent in [soup] + list(soup.find_all(True)):
-        process_parent_for_numbered_with_nested(parent)
-        process_parent_simple_runs(parent)
-
-    return str(soup)
+    return _settle_whitespace(soup, texts)
 
 
 # ---------- Page number move to footer ----------
 
 def move_page_number_to_footer(html_fragment: str) -> Tuple[str, str, Optional[str]]:
-    soup = BeautifulSoup(html_fragment, 'html.parser')
+    soup, footer_html, page_num = move_page_number_to_footer_tree(BeautifulSoup(html_fragment, 'html.parser'))
+    return str(soup), footer_html, page_num
+
+
+def move_page_number_to_footer_tree(soup: BeautifulSoup, texts: Optional[TextCache] = None) -> Tuple[BeautifulSoup, str, Optional[str]]:
+    texts = TextCache() if texts is None else texts
     page_num: Optional[str] = None
 
     pn_divs = soup.find_all("div", class_="epub-page-number")
     if pn_divs:
-        text = pn_divs[-1].get_text(" ", strip=True)
+        text = texts.get(pn_divs[-1], " ", strip=True)
         nums = re.findall(r"(\d+)", text)
         if nums:
             page_num = nums[-1].lstrip("0") or "0"
         for d in pn_divs:
+            texts.invalidate(d)
             d.decompose()
 
     for p in reversed(soup.find_all("p")):
-        t = p.get_text(strip=True)
+        t = texts.get(p, strip=True)
         if t.isdigit():
             sib = p.next_sibling
             trailing = True
@@ -346,17 +489,19 @@ def move_page_number_to_footer(html_fragment: str) -> Tuple[str, str, Optional[s
             if trailing:
                 if page_num is None:
                     page_num = t.lstrip("0") or "0"
+                texts.invalidate(p)
                 p.decompose()
                 break
 
     all_p = soup.find_all("p")
     if all_p:
         last_p = all_p[-1]
-        raw = last_p.get_text()
+        raw = texts.get(last_p)
         m = re.search(r"\s(\d{1,6})\s*$", raw)
         if m:
             digits = m.group(1)
             new_text = re.sub(r"\s\d{1,6}\s*$", "", raw)
+            texts.invalidate(last_p)
             last_p.clear()
             last_p.append(NavigableString(new_text))
             if page_num is None:
@@ -374,13 +519,16 @@ def move_page_number_to_footer(html_fragment: str) -> Tuple[str, str, Optional[s
         footer.append(p_tag)
         footer_html = str(footer)
 
-    return str(soup), footer_html, page_num
+    return _settle_whitespace(soup, texts), footer_html, page_num
 
 
 # ---------- Text recompute from HTML fragment ----------
 
 def recompute_text_from_html_fragment(html_fragment: str) -> str:
-    soup = BeautifulSoup(html_fragment, 'html.parser')
+    return recompute_text_from_tree(BeautifulSoup(html_fragment, 'html.parser'))
+
+
+def recompute_text_from_tree(soup: BeautifulSoup) -> str:
     lines: List[str] = []
 
     def clean(t: str) -> str:
@@ -462,13 +610,16 @@ def recompute_text_from_html_fragment(html_fragment: str) -> str:
 # ---------- H1 injection ----------
 
 def inject_h1_for_runtime_match(fragment: str, candidates: List[str]) -> Tuple[str, Optional[str]]:
-    soup = BeautifulSoup(fragment, 'html.parser')
+    soup, chosen = inject_h1_for_runtime_match_tree(BeautifulSoup(fragment, 'html.parser'), candidates)
+    return str(soup), chosen
 
+
+def inject_h1_for_runtime_match_tree(soup: BeautifulSoup, candidates: List[str]) -> Tuple[BeautifulSoup, Optional[str]]:
     def norm(s: str) -> str:
         return re.sub(r"\s+", " ", (s or "").strip()).lower()
 
     if not candidates:
-        return str(soup), None
+        return soup, None
 
     h2s = soup.find_all("h2")
     cand_norms = [norm(c) for c in candidates]
@@ -478,9 +629,9 @@ def inject_h1_for_runtime_match(fragment: str, candidates: List[str]) -> Tuple[s
         if norm(h2_text) in cand_norms:
             chosen = h2_text
             h2.decompose()
-            return str(soup), chosen
+            return _settle_whitespace(soup), chosen
 
-    return str(soup), None
+    return soup, None
 
 
 # ---------- insertion fragment & patching ----------
@@ -488,55 +639,214 @@ def inject_h1_for_runtime_match(fragment: str, candidates: List[str]) -> Tuple[s
 def build_insertion_fragment(hgroup_html: str, structured_content: str, footer_html: str) -> str:
     return f"<main role=\"main\">\n{hgroup_html}{structured_content}\n</main>\n{footer_html}"
 
-def patch_source_file(original_path: Path, insertion_fragment_html: str, insert_after_id: str = "parent-p1", backup: bool = False) -> Tuple[bool, str]:
-    """
-    Safely insert insertion_fragment_html inside element with id=insert_after_id (as first children).
-    If anchor not found, append to body. Sets aria-hidden="true" on all spans.
-    Returns (patched_bool, note).
-    """
+# The injected block sits between two marker comments; the begin marker carries the
+# fragment's sha256, so a re-run can skip an identical block or replace a stale one,
+# and processing a patched chapter reads it without the block.
+INJECTED_BEGIN = "reading-order:begin"
+INJECTED_END = "reading-order:end"
+_INJECTED_BLOCK_RE = re.compile(r"<!--reading-order:begin (?P<digest>[0-9a-f]{64})-->.*?<!--reading-order:end-->", re.S)
+
+def fragment_digest(insertion_fragment_html: str) -> str:
+    return hashlib.sha256(insertion_fragment_html.encode("utf-8", "surrogatepass")).hexdigest()
+
+def strip_injected_block(html_src: str) -> str:
+    return _INJECTED_BLOCK_RE.sub("", html_src)
+
+def _universal_newlines(text: str) -> str:
+    # Path.read_text() translates line endings; archive members get the same treatment
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+def decode_source(data: bytes) -> str:
+    """Decode chapter bytes the way patch_source_file reads them (utf-8, else cp1252)."""
     try:
-        try:
-            content = original_path.read_text(encoding="utf-8")
-        except UnicodeDecodeError:
-            content = original_path.read_text(encoding="cp1252", errors="ignore")
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        text = data.decode("cp1252", errors="ignore")
+    return _universal_newlines(text)
+
+# ---------- Splice-based patching ----------
+# Patching never re-serializes the chapter: one scan over the source finds the anchor
+# start tag and every <span> start tag by offset, and the fragment and aria-hidden
+# attributes are spliced into the original text. Comments, declarations and
+# script/style bodies are skipped the way html.parser skips them.
+
+_PATCH_TOKEN_RE = re.compile(r"""
+    <!--.*?-->
+  | <!\[CDATA\[.*?\]\]>
+  | <[!?][^>]*>
+  | <(?P<end>/)?(?P<name>[A-Za-z][^\s/>]*)(?P<attrs>(?:[^>"']|"[^"]*"|'[^']*')*)>
+""", re.S | re.X)
+_PATCH_ATTR_RE = re.compile(r"""(?P<name>[^\s"'>/=]+)(?:\s*=\s*(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<uq>[^\s"'>]+)))?""")
+_RAW_TEXT_END_RE = {name: re.compile(rf"</{name}\s*>", re.I) for name in ("script", "style")}
+
+def _scan_tags(html_src: str):
+    """Yield (match, lowercased tag name, is_end_tag) for each tag in html_src, in order."""
+    pos = 0
+    while True:
+        m = _PATCH_TOKEN_RE.search(html_src, pos)
+        if not m:
+            return
+        pos = m.end()
+        name = m.group("name")
+        if name is None:
+            continue
+        name = name.lower()
+        is_end = bool(m.group("end"))
+        yield m, name, is_end
+        if not is_end and name in _RAW_TEXT_END_RE and not m.group("attrs").rstrip().endswith("/"):
+            close = _RAW_TEXT_END_RE[name].search(html_src, pos)
+            pos = close.start() if close else len(html_src)
+
+def _attr_value(attrs: str, name: str) -> Optional[str]:
+    value = None
+    for a in _PATCH_ATTR_RE.finditer(attrs):
+        if a.group("name").lower() == name:
+            # html.parser keeps the last duplicate
+            value = ihtml.unescape(a.group("dq") or a.group("sq") or a.group("uq") or "")
+    return value
+
+def _hide_span_attrs(attrs: str) -> Optional[str]:
+    """attrs with aria-hidden="true" set, or None if it already is."""
+    found = None
+    for a in _PATCH_ATTR_RE.finditer(attrs):
+        if a.group("name").lower() == "aria-hidden":
+            found = a
+    if found is not None:
+        if ihtml.unescape(found.group("dq") or found.group("sq") or found.group("uq") or "") == "true":
+            return None
+        return f'{attrs[:found.start()]}aria-hidden="true"{attrs[found.end():]}'
+    trimmed = attrs.rstrip()
+    if trimmed.endswith("/"):
+        return f'{trimmed[:-1].rstrip()} aria-hidden="true"/'
+    return f'{trimmed} aria-hidden="true"'
 
-        soup = BeautifulSoup(content, "html.parser")
-        anchor = soup.find(id=insert_after_id)
+def _splice_patch(html_src: str, block: Optional[str], insert_after_id: str) -> Tuple[str, bool, int, int]:
+    """
+    Mark every <span> in html_src aria-hidden and, if block is given, insert it as the
+    first content of the element with id=insert_after_id (else at the end of <body>).
+    Returns (patched_html, anchor_found, total_spans, updated_spans).
+    """
+    edits: List[Tuple[int, int, str]] = []
+    anchor_found = False
+    body_seen = False
+    body_end = html_end = None
+    total_spans = updated_spans = 0
+
+    for m, name, is_end in _scan_tags(html_src):
+        if is_end:
+            if name == "body":
+                body_end = m.start()
+            elif name == "html":
+                html_end = m.start()
+            continue
+        if name == "body":
+            body_seen = True
+        attrs = m.group("attrs")
+        new_attrs = None
+        if name == "span":
+            total_spans += 1
+            new_attrs = _hide_span_attrs(attrs)
+            if new_attrs is not None:
+                updated_spans += 1
+        is_anchor = block is not None and not anchor_found and _attr_value(attrs, "id") == insert_after_id
+        if not is_anchor and new_attrs is None:
+            continue
+        tag_name = m.group("name")
+        attrs_out = attrs if new_attrs is None else new_attrs
+        if is_anchor:
+            anchor_found = True
+            trimmed = attrs_out.rstrip()
+            if trimmed.endswith("/"):
+                # <div id="..."/> - give it a body to hold the block
+                edits.append((m.start(), m.end(), f"<{tag_name}{trimmed[:-1].rstrip()}>{block}</{tag_name}>"))
+            else:
+                edits.append((m.start(), m.end(), f"<{tag_name}{attrs_out}>{block}"))
+        else:
+            edits.append((m.start("attrs"), m.end("attrs"), new_attrs))
 
+    if block is not None and not anchor_found:
+        if body_end is not None:
+            at = body_end
+        elif body_seen and html_end is not None:
+            at = html_end
+        else:
+            at = len(html_src)
+        edits.append((at, at, block))
+        edits.sort(key=lambda e: e[0])
+
+    pieces = []
+    last = 0
+    for start, end, text in edits:
+        pieces.append(html_src[last:start])
+        pieces.append(text)
+        last = end
+    pieces.append(html_src[last:])
+    return "".join(pieces), anchor_found, total_spans, updated_spans
+
+def patch_html(content: str, insertion_fragment_html: str, insert_after_id: str = "parent-p1") -> Tuple[Optional[str], str]:
+    """
+    In-memory core of patch_source_file. Returns (patched_html, note);
+    patched_html is None when nothing was patched, and content itself when
+    content already carries this exact block.
+    """
+    try:
+        digest = fragment_digest(insertion_fragment_html)
+        existing = _INJECTED_BLOCK_RE.search(content)
+        if existing and existing.group("digest") == digest:
+            return content, "Reading-order block already up to date; left unchanged."
+        replaced = existing is not None
+        if replaced:
+            content = strip_injected_block(content)
+
+        # the fragment is ours and small; parsing it drops whitespace between its top-level nodes
         frag = BeautifulSoup(insertion_fragment_html, "html.parser")
         nodes = [n for n in list(frag.contents) if not (isinstance(n, NavigableString) and not str(n).strip())]
 
         if not nodes:
-            return False, "Insertion fragment is empty"
+            return None, "Insertion fragment is empty"
+        fragment, _, frag_spans, frag_updated = _splice_patch("".join(str(n) for n in nodes), None, insert_after_id)
+        block = f"<!--{INJECTED_BEGIN} {digest}-->{fragment}<!--{INJECTED_END}-->"
+
+        patched, anchor_found, total_spans, updated_spans = _splice_patch(content, block, insert_after_id)
+        total_spans += frag_spans
+        updated_spans += frag_updated
 
-        if anchor:
-            # insert reversed so the first node becomes first child
-            for node in reversed(nodes):
-                anchor.insert(0, node)
+        if anchor_found:
             where_note = f"Inserted inside id='{insert_after_id}' (as first children)."
         else:
-            target = soup.body or soup
-            for node in nodes:
-                target.append(node)
             where_note = f"Anchor id='{insert_after_id}' not found; appended to <body>."
+        if replaced:
+            where_note = "Replaced previous reading-order block. " + where_note
+        note = f"{where_note} Set aria-hidden='true' on {updated_spans}/{total_spans} <span> elements."
+        return patched, note
 
-        # Set aria-hidden="true" on all spans
-        span_nodes = soup.find_all("span")
-        total_spans = len(span_nodes)
-        updated_spans = 0
-        for sp in span_nodes:
-            if sp.get("aria-hidden") != "true":
-                sp["aria-hidden"] = "true"
-                updated_spans += 1
+    except Exception as e:
+        return None, f"Patch error: {type(e).__name__}: {e}"
 
-        if backup:
-            shutil.copy2(original_path, original_path.with_suffix(original_path.suffix + ".bak"))
-        original_path.write_text(str(soup), encoding="utf-8")
-        note = f"{where_note} Set aria-hidden='true' on {updated_spans}/{total_spans} <span> elements."
+def patch_source_file(original_path: Path, insertion_fragment_html: str, insert_after_id: str = "parent-p1", backup: bool = False) -> Tuple[bool, str]:
+    """
+    Safely insert insertion_fragment_html inside element with id=insert_after_id (as first children).
+    If anchor not found, append to body. Sets aria-hidden="true" on all spans.
+    Returns (patched_bool, note).
+    """
+    try:
+        content = decode_source(original_path.read_bytes())
+    except Exception as e:
+        return False, f"Patch error: {type(e).__name__}: {e}"
+
+    patched, note = patch_html(content, insertion_fragment_html, insert_after_id)
+    if patched is None:
+        return False, note
+    if patched is content:
         return True, note
 
+    try:
+        if backup:
+            shutil.copy2(original_path, original_path.with_suffix(original_path.suffix + ".bak"))
+        original_path.write_text(patched, encoding="utf-8")
     except Exception as e:
         return False, f"Patch error: {type(e).__name__}: {e}"
+    return True, note
 
 
 # ---------- Table detection utilities (copied/adapted) ----------
@@ -583,8 +893,175 @@ def build_html_ol(items: List[str], start: Optional[int] = None, ol_type: Option
     out.append("</ol>")
     return "\n".join(out)
 
-# For brevity the following table detection helpers are included exactly as needed by _build_ptable_stream_from_css
+# ---------- Native CSS position scanner ----------
+# Fixed-layout stylesheets are thousands of "#id { position:absolute; left:..; top:.. }"
+# rules. Those are read with a small scanner; any rule it does not fully understand
+# (escapes, !important, strings, attribute/pseudo selectors, odd declarations) is
+# handed to cssutils, and a sheet it cannot even tokenize is parsed by cssutils whole.
+
+_CSS_COMMENT_RE = re.compile(r'/\*.*?(?:\*/|\Z)', re.S)
+_CSS_SIMPLE_RULE_RE = re.compile(r'\s*([^{}@;"\'\\]+?)\s*\{([^{}"\'\\]*)\}')
+_CSS_MEDIA_OPEN_RE = re.compile(r'\s*@media\b[^{};"\'\\]*\{', re.I)
+_CSS_IDENT = r'-?[_a-zA-Z][_a-zA-Z0-9-]*'
+_CSS_COMPOUND = rf'(?:(?:{_CSS_IDENT}|\*)(?:[#.]{_CSS_IDENT})*|(?:[#.]{_CSS_IDENT})+)'
+_CSS_SELECTOR_RE = re.compile(rf'{_CSS_COMPOUND}(?:\s*[>+~]\s*{_CSS_COMPOUND}|\s+{_CSS_COMPOUND})*')
+_CSS_IDENT_RE = re.compile(_CSS_IDENT)
+_CSS_EXPONENT_RE = re.compile(r'\d[eE][-+]?\d')
+_CSS_POSITION_PROPS = ('left', 'top', 'bottom')
+
+class _CssScanError(Exception):
+    pass
+
+def _selector_key(s: str) -> Optional[str]:
+    if s.startswith('#'):
+        return s[1:]
+    if s.startswith('.'):
+        return s[1:]
+    mid = re.search(r'#([A-Za-z0-9_-]+)', s)
+    mcl = re.search(r'\.([A-Za-z0-9_-]+)', s)
+    if mid:
+        return mid.group(1)
+    if mcl:
+        return mcl.group(1)
+    return None
+
+def _native_rule_positions(prelude: str, block: str) -> Optional[Tuple[List[str], Optional[Tuple[float, float]]]]:
+    """
+    Read one style rule. Returns (keys, (y, x) or None), or None when cssutils
+    has to decide (anything outside the simple selector/declaration subset).
+    """
+    if '!' in block or '(' in block:
+        return None
+    left = top = bottom = None
+    for decl in block.split(';'):
+        if not decl.strip():
+            continue
+        name, sep, value = decl.partition(':')
+        name = name.strip()
+        if not sep or not _CSS_IDENT_RE.fullmatch(name):
+            if any(p in decl.lower() for p in _CSS_POSITION_PROPS):
+                return None
+            continue
+        n = name.lower()
+        if n not in _CSS_POSITION_PROPS:
+            continue
+        value = value.strip()
+        if not value or _CSS_EXPONENT_RE.search(value):
+            return None
+        if n == 'left':
+            left = _num(value)
+        elif n == 'top':
+            top = _num(value)
+        else:
+            bottom = _num(value)
+    if left is None or (top is None and bottom is None):
+        return [], None
+
+    keys = []
+    for sel in prelude.split(','):
+        sel = sel.strip()
+        if not _CSS_SELECTOR_RE.fullmatch(sel):
+            return None
+        # match cssutils' serialized selectorText
+        sel = re.sub(r'\s*([>+~])\s*', r' \1 ', sel)
+        sel = re.sub(r'\s+', ' ', sel)
+        key = _selector_key(sel)
+        if key:
+            keys.append(key)
+    y_vis = top if top is not None else -bottom
+    return keys, (y_vis, left)
+
+def _skip_css_block(text: str, i: int) -> int:
+    # i points just past an opening "{"; returns the index just past its matching "}"
+    depth = 1
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch in '"\'':
+            j = i + 1
+            while j < n and text[j] != ch:
+                if text[j] in '\n\\':
+                    raise _CssScanError("string escape or newline")
+                j += 1
+            i = j + 1
+            continue
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise _CssScanError("unterminated block")
+
+def _scan_css_positions(css_text: str) -> Dict[str, Tuple[float, float]]:
+    text = _CSS_COMMENT_RE.sub(' ', css_text)
+    positions: Dict[str, Tuple[float, float]] = {}
+    pending: List[str] = []
+
+    def flush() -> None:
+        if pending:
+            positions.update(_extract_positions_cssutils("\n".join(pending)))
+            pending.clear()
+
+    i, n, media_depth = 0, len(text), 0
+    while True:
+        m = _CSS_SIMPLE_RULE_RE.match(text, i)
+        if m:
+            i = m.end()
+            found = _native_rule_positions(m.group(1), m.group(2))
+            if found is None:
+                pending.append(m.group(0))
+            elif found[1] is not None:
+                flush()
+                for key in found[0]:
+                    positions[key] = found[1]
+            continue
+        while i < n and text[i].isspace():
+            i += 1
+        if i >= n:
+            break
+        if text.startswith('<!--', i) or text.startswith('-->', i):
+            i += 4 if text[i] == '<' else 3
+            continue
+        if text[i] == '}':
+            if not media_depth:
+                raise _CssScanError("unbalanced }")
+            media_depth -= 1
+            i += 1
+            continue
+        m = _CSS_MEDIA_OPEN_RE.match(text, i)
+        if m:
+            media_depth += 1
+            i = m.end()
+            continue
+        # anything else: find where this rule ends
+        j = i
+        while j < n and text[j] not in '{;}"\'':
+            j += 1
+        if j >= n or text[j] in '}"\'':
+            raise _CssScanError("unexpected token")
+        if text[i] == '@':
+            # other at-rules (@import, @font-face, @page, ...) carry no positions
+            i = j + 1 if text[j] == ';' else _skip_css_block(text, j + 1)
+            continue
+        if text[j] == ';':
+            raise _CssScanError("stray declaration")
+        end = _skip_css_block(text, j + 1)
+        pending.append(text[i:end])
+        i = end
+    if media_depth:
+        raise _CssScanError("unterminated @media")
+    flush()
+    return positions
+
 def extract_positions_from_css(css_text):
+    try:
+        return _scan_css_positions(css_text or "")
+    except _CssScanError:
+        return _extract_positions_cssutils(css_text)
+
+def _extract_positions_cssutils(css_text):
     import cssutils
     cssutils.log.setLevel(40)
     sheet = cssutils.parseString(css_text)
@@ -604,19 +1081,7 @@ def extract_positions_from_css(css_text):
             if left is not None and (top is not None or bottom is not None):
                 y_vis = top if top is not None else -bottom
                 for sel in rule.selectorText.split(','):
-                    s = sel.strip()
-                    key = None
-                    if s.startswith('#'):
-                        key = s[1:]
-                    elif s.startswith('.'):
-                        key = s[1:]
-                    else:
-                        mid = re.search(r'#([A-Za-z0-9_-]+)', s)
-                        mcl = re.search(r'\.([A-Za-z0-9_-]+)', s)
-                        if mid:
-                            key = mid.group(1)
-                        elif mcl:
-                            key = mcl.group(1)
+                    key = _selector_key(sel.strip())
                     if key:
                         positions[key] = (y_vis, left)
 
@@ -628,105 +1093,221 @@ def extract_positions_from_css(css_text):
         handle_rule(r)
     return positions
 
-def collect_tokens(html_str, css_text, allow_classes=None, parser="lxml"):
-    pos = extract_positions_from_css(css_text)
-    soup = BeautifulSoup(html_str, parser)
-    toks = []
-    for sp in soup.find_all('span'):
-        txt = sp.get_text(strip=True)
-        if not txt:
-            continue
-        classes = tokens_attr(sp, 'class')
-        style_class = next((c for c in classes if isinstance(c, str) and c.startswith('styleid')), None)
-        if allow_classes is not None and style_class not in allow_classes:
-            continue
-        key = sp.get('id')
-        if key not in pos:
-            for c in classes:
-                if c in pos:
-                    key = c
-                    break
-        if key not in pos:
-            continue
-        y, x = pos[key]
-        toks.append({'y': y, 'x': x, 'cls': style_class, 'text': txt})
-    toks.sort(key=lambda t: (t['y'], t['x']))
-    for i, t in enumerate(toks):
-        t['idx'] = i
-    return toks
+# ---------- Columnar token engine ----------
+# Page tokens as parallel NumPy columns (y, x, class id, idx) plus interned class and
+# text tables. Line grouping, nearest-anchor column assignment and band membership
+# are array operations here; the dict-based functions further down wrap this engine.
+
+class TokenTable:
+    """Columnar page tokens. Row order is the token order (collect_tokens: sorted by (y, x))."""
+
+    def __init__(self, y, x, cls_ids, classes, text_ids, texts, idx=None):
+        self.y = np.asarray(y, dtype=np.float64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.cls = np.asarray(cls_ids, dtype=np.int32)
+        self.classes = classes
+        self.text_ids = np.asarray(text_ids, dtype=np.int32)
+        self.texts = texts
+        self.idx = np.arange(len(self.y)) if idx is None else np.asarray(idx, dtype=np.int64)
+        self._class_ids = {c: i for i, c in enumerate(classes)}
+
+    def __len__(self):
+        return len(self.y)
+
+    @classmethod
+    def from_rows(cls, rows, sort=True):
+        # rows: iterable of (y, x, style_class, text)
+        classes: List[Optional[str]] = []
+        texts: List[str] = []
+        class_ids: Dict[Optional[str], int] = {}
+        text_ids: Dict[str, int] = {}
+        ys, xs, cs, ts = [], [], [], []
+        for y, x, c, t in rows:
+            ys.append(y)
+            xs.append(x)
+            if c not in class_ids:
+                class_ids[c] = len(classes)
+                classes.append(c)
+            cs.append(class_ids[c])
+            if t not in text_ids:
+                text_ids[t] = len(texts)
+                texts.append(t)
+            ts.append(text_ids[t])
+        table = cls(ys, xs, cs, classes, ts, texts)
+        if sort and len(table):
+            order = np.lexsort((table.x, table.y))
+            table = cls(table.y[order], table.x[order], table.cls[order], classes, table.text_ids[order], texts)
+        return table
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        table = cls.from_rows(((t['y'], t['x'], t['cls'], t['text']) for t in tokens), sort=False)
+        table.idx = np.asarray([t['idx'] for t in tokens], dtype=np.int64)
+        return table
+
+    def to_tokens(self):
+        return [
+            {'y': float(self.y[i]), 'x': float(self.x[i]), 'cls': self.classes[self.cls[i]],
+             'text': self.texts[self.text_ids[i]], 'idx': int(self.idx[i])}
+            for i in range(len(self))
+        ]
+
+    def class_id(self, name):
+        return self._class_ids.get(name, -1)
+
+    def text(self, row):
+        return self.texts[self.text_ids[row]]
+
+    def join_text(self, rows):
+        return tidy_text(" ".join(self.texts[t] for t in self.text_ids[rows]))
+
+    def idx_set(self, rows):
+        return set(self.idx[rows].tolist())
+
+def _rows_of_classes(table, names):
+    return np.flatnonzero(np.isin(table.cls, [table.class_id(n) for n in names]))
+
+def _sort_rows_xy(table, rows):
+    # stable, like sorted(..., key=lambda t: (t['y'], t['x']))
+    return rows[np.lexsort((table.x[rows], table.y[rows]))]
+
+def _line_starts(ys, y_tol):
+    # first position of every line for group_by_y's rule on y-sorted values
+    n = len(ys)
+    # a gap wider than y_tol always opens a line ...
+    starts = np.flatnonzero(np.r_[True, ys[1:] - ys[:-1] > y_tol])
+    ends = np.r_[starts[1:], n]
+    if not np.any(ys[ends - 1] - ys[starts] > y_tol):
+        return starts
+    # ... and only runs spanning more than y_tol need the sequential walk
+    out = []
+    for a, b in zip(starts.tolist(), ends.tolist()):
+        out.append(a)
+        cur = a
+        while ys[b - 1] - ys[cur] > y_tol:
+            k = int(np.searchsorted(ys, ys[cur] + y_tol, side='right'))
+            while k > cur + 1 and ys[k - 1] - ys[cur] > y_tol:
+                k -= 1
+            while k < b and not (ys[k] - ys[cur] > y_tol):
+                k += 1
+            out.append(k)
+            cur = k
+    return np.asarray(out, dtype=np.int64)
+
+def group_token_lines(table, rows, y_tol=8.0):
+    """
+    group_by_y over the table rows `rows` (in that order).
+    Returns [(line_y, rows sorted by x)].
+    """
+    n = len(rows)
+    if not n:
+        return []
+    ys = table.y[rows]
+    if n > 1 and np.any(ys[1:] < ys[:-1]):
+        starts = [0]
+        for k in range(1, n):
+            if abs(ys[k] - ys[starts[-1]]) > y_tol:
+                starts.append(k)
+        starts = np.asarray(starts, dtype=np.int64)
+    else:
+        starts = _line_starts(ys, y_tol)
+    bounds = np.r_[starts, n]
+    line_of = np.repeat(np.arange(len(starts)), np.diff(bounds))
+    ordered = rows[np.lexsort((table.x[rows], line_of))]
+    return [(float(ys[a]), ordered[a:b]) for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
 
-def group_by_y(tokens, y_tol=8.0):
-    lines, cur = [], None
-    for t in tokens:
-        if cur is None or abs(t['y'] - cur['y']) > y_tol:
-            cur = {'y': t['y'], 'items': [t]}
-            lines.append(cur)
+def assign_y_bands(ys, los, his):
+    """
+    All (position, band) pairs with los[band] <= ys[position] <= his[band].
+    A y sitting exactly on a shared edge lands in both bands, as with a per-band
+    scan. Increasing bands are resolved with two searchsorted calls.
+    """
+    ys = np.asarray(ys, dtype=np.float64)
+    los = np.asarray(los, dtype=np.float64)
+    his = np.asarray(his, dtype=np.float64)
+    if len(los) < 2 or (np.all(los[1:] > los[:-1]) and np.all(his[1:] > his[:-1])):
+        first = np.searchsorted(his, ys, side='left')
+        last = np.searchsorted(los, ys, side='right') - 1
+        counts = np.maximum(last - first + 1, 0)
+        pos = np.repeat(np.arange(len(ys)), counts)
+        offsets = np.arange(len(pos)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return pos, np.repeat(first, counts) + offsets
+    order = np.argsort(ys, kind='stable')
+    ys_sorted = ys[order]
+    hits = [np.sort(order[np.searchsorted(ys_sorted, lo, side='left'):np.searchsorted(ys_sorted, hi, side='right')])
+            for lo, hi in zip(los, his)]
+    bands = np.repeat(np.arange(len(hits)), [len(h) for h in hits])
+    return (np.concatenate(hits) if hits else np.zeros(0, dtype=np.int64)), bands
+
+def _band_edges(ys, lower_fudge=0.0):
+    # band i spans the midpoints to its neighbours (open-ended at both ends)
+    def mid(a, b): return (a + b) / 2.0
+    n = len(ys)
+    los = [mid(ys[i-1], ys[i]) if i > 0 else ys[i] - 1e6 for i in range(n)]
+    his = []
+    for i in range(n):
+        if i + 1 < n:
+            his.append(mid(ys[i], ys[i+1]) + lower_fudge * max(0, ys[i+1] - ys[i]))
         else:
-            cur['items'].append(t)
-    for ln in lines:
-        ln['items'].sort(key=lambda z: z['x'])
-    return lines
-
-def x_span(tokens):
-    xs = [t['x'] for t in tokens]
-    return (min(xs), max(xs), (max(xs) - min(xs)) if xs else 0.0)
+            his.append(ys[i] + 1e6)
+    return los, his
 
-# -- simplified detectors reusing original logic (only what's necessary) --
-def detect_comparison_table(tokens, header_cls='styleid4', label_cls='styleid4', value_cls='styleid5', y_tol=8.0, min_rows=3):
-    # (copied/adapted from original, returns dict or None)
-    allow = {header_cls, label_cls, value_cls}
-    toks = [t for t in tokens if t['cls'] in allow]
-    if not toks:
+def detect_comparison_table_columnar(table, header_cls='styleid4', label_cls='styleid4', value_cls='styleid5', y_tol=8.0, min_rows=3):
+    sel = _rows_of_classes(table, (header_cls, label_cls, value_cls))
+    if not sel.size:
         return None
-    _, _, span = x_span(toks)
+    sel_x = table.x[sel]
+    span = sel_x.max() - sel_x.min()
     if span <= 0:
         return None
 
-    hdr_tokens = [t for t in toks if t['cls'] == header_cls]
-    hdr_lines = [ln for ln in group_by_y(sorted(hdr_tokens, key=lambda z:(z['y'], z['x'])), y_tol=y_tol) if len(ln['items']) >= 3]
+    hdr_id, lab_id, val_id = table.class_id(header_cls), table.class_id(label_cls), table.class_id(value_cls)
+    hdr = _sort_rows_xy(table, sel[table.cls[sel] == hdr_id])
+    hdr_lines = [ln for ln in group_token_lines(table, hdr, y_tol=y_tol) if len(ln[1]) >= 3]
     if not hdr_lines:
         return None
 
-    header_line = hdr_lines[0]
-    items = sorted(header_line['items'], key=lambda z: z['x'])[:3]
-    anchors = [c['x'] for c in items]
-    header_texts = [tidy_text(c['text']) for c in items]
-    used = {t['idx'] for t in items}
+    header_y, header_rows = hdr_lines[0]
+    items = header_rows[:3]
+    anchors = table.x[items]
+    header_texts = [tidy_text(table.text(i)) for i in items]
+    used = table.idx_set(items)
 
     gaps = [anchors[1]-anchors[0], anchors[2]-anchors[1]]
     if min(gaps) < 0.10 * span:
         return None
 
-    lab_toks = [t for t in toks if t['cls'] == label_cls and t['y'] > header_line['y']]
-    label_lines = group_by_y(lab_toks, y_tol=y_tol)
+    lab = sel[(table.cls[sel] == lab_id) & (table.y[sel] > header_y)]
+    label_lines = group_token_lines(table, lab, y_tol=y_tol)
     if len(label_lines) < min_rows:
         return None
 
-    def mid(a, b): return (a + b) / 2.0
+    # nearest header anchor for every candidate token (ties go left, like min(range(3)))
+    sel_y, sel_cls = table.y[sel], table.cls[sel]
+    col_of = np.argmin(np.abs(sel_x[:, None] - anchors[None, :]), axis=1)
+    keep = (sel_y != header_y) & np.where(col_of == 0, sel_cls == lab_id, sel_cls == val_id)
+    cand = np.flatnonzero(keep)
+
+    # every kept token goes to each label band containing it; cells are (band, column)
+    los, his = _band_edges([ln[0] for ln in label_lines])
+    pos, band_of = assign_y_bands(sel_y[cand], los, his)
+    cell_rows = sel[cand[pos]]
+    cell_key = band_of * 3 + col_of[cand[pos]]
+    order = np.lexsort((table.x[cell_rows], table.y[cell_rows], cell_key))
+    cell_rows, cell_key = cell_rows[order], cell_key[order]
+    used.update(table.idx[cell_rows].tolist())
+    cells = {}
+    if len(cell_key):
+        starts = np.flatnonzero(np.r_[True, cell_key[1:] != cell_key[:-1]])
+        for a, b in zip(starts, np.r_[starts[1:], len(cell_key)]):
+            cells[int(cell_key[a])] = table.join_text(cell_rows[a:b])
 
     rows = []
     nonempty_both = 0
-    for i, ln in enumerate(label_lines):
-        y_label = ln['y']
-        y_prev = label_lines[i-1]['y'] if i > 0 else y_label - 1e6
-        y_next = label_lines[i+1]['y'] if i+1 < len(label_lines) else y_label + 1e6
-        band_lo, band_hi = mid(y_prev, y_label), mid(y_label, y_next)
-
-        band = [t for t in toks if band_lo <= t['y'] <= band_hi and t['y'] != header_line['y']]
-        cols = {0: [], 1: [], 2: []}
-        for t in band:
-            j = min(range(3), key=lambda k: abs(t['x'] - anchors[k]))
-            cols[j].append(t)
-
-        def merge(ts, allowed_cls=None):
-            keep = [z for z in ts if (allowed_cls is None or z['cls'] in allowed_cls)]
-            keep.sort(key=lambda z: (z['y'], z['x']))
-            for z in keep: used.add(z['idx'])
-            return tidy_text(" ".join(z['text'] for z in keep))
-
-        label = merge(cols[0], allowed_cls={label_cls})
-        col1  = merge(cols[1], allowed_cls={value_cls})
-        col2  = merge(cols[2], allowed_cls={value_cls})
+    for i in range(len(label_lines)):
+        label = cells.get(i * 3, "")
+        col1  = cells.get(i * 3 + 1, "")
+        col2  = cells.get(i * 3 + 2, "")
 
         if any([label, col1, col2]):
             rows.append([label, col1, col2])
@@ -736,29 +1317,30 @@ def detect_comparison_table(tokens, header_cls='styleid4', label_cls='styleid4',
     if len(rows) < min_rows or (nonempty_both / len(rows) < 0.6):
         return None
 
-    ymin = min(tokens[i]['y'] for i in used) if used else None
-    ymax = max(tokens[i]['y'] for i in used) if used else None
+    ymin = float(table.y[list(used)].min()) if used else None
+    ymax = float(table.y[list(used)].max()) if used else None
     html_table = build_html_table(header_texts, rows)
     return {'kind':'comparison_3col','header':header_texts,'rows':rows,'html':html_table,'used_idx':used,'ymin':ymin,'ymax':ymax}
 
-def detect_fact_table(tokens, label_cls='styleid3', value_cls='styleid4', y_tol=6.0, lower_fudge=0.30, min_rows=3):
-    allow = {label_cls, value_cls}
-    toks = [t for t in tokens if t['cls'] in allow]
-    if not toks:
+def detect_fact_table_columnar(table, label_cls='styleid3', value_cls='styleid4', y_tol=6.0, lower_fudge=0.30, min_rows=3):
+    sel = _rows_of_classes(table, (label_cls, value_cls))
+    if not sel.size:
         return None
-    _, _, span = x_span(toks)
+    sel_x = table.x[sel]
+    span = sel_x.max() - sel_x.min()
     if span <= 0:
         return None
 
-    lines = group_by_y(toks, y_tol=y_tol)
+    lab_id, val_id = table.class_id(label_cls), table.class_id(value_cls)
+    lines = group_token_lines(table, sel, y_tol=y_tol)
     label_lines = []
-    for ln in lines:
-        labs = [it for it in ln['items'] if it['cls'] == label_cls]
-        if labs:
-            text = tidy_text(" ".join(x['text'] for x in sorted(labs, key=lambda z: z['x'])))
-            lx = median([x['x'] for x in labs]) if labs else 0
+    for ly, items in lines:
+        labs = items[table.cls[items] == lab_id]
+        if labs.size:
+            text = table.join_text(labs)
+            lx = median(table.x[labs].tolist()) if labs.size else 0
             if text:
-                label_lines.append({'y': ln['y'], 'text': text, 'x': lx, 'items': labs})
+                label_lines.append({'y': ly, 'text': text, 'x': lx, 'items': labs})
     if len(label_lines) < min_rows:
         return None
 
@@ -766,39 +1348,31 @@ def detect_fact_table(tokens, label_cls='styleid3', value_cls='styleid4', y_tol=
     if spread > 0.07 * span:
         return None
 
-    def mid(a,b): return (a+b)/2.0
-
     used = set()
     rows = []
     value_x_all = []
     with_value = 0
 
+    # value rows and text per line, computed once and shared by every band it falls in
+    line_vals = [items[table.cls[items] == val_id] for _, items in lines]
+    line_segs = [table.join_text(vs) if vs.size else "" for vs in line_vals]
+    los, his = _band_edges([lab['y'] for lab in label_lines], lower_fudge=lower_fudge)
+    line_pos, band_of = assign_y_bands([ln[0] for ln in lines], los, his)
+    order = np.lexsort((line_pos, band_of))
+    line_pos, band_of = line_pos[order], band_of[order]
+    band_starts = np.searchsorted(band_of, np.arange(len(label_lines) + 1), side='left')
+
     for k, lab in enumerate(label_lines):
-        y_label = lab['y']
-        for it in lab['items']:
-            used.add(it['idx'])
-        y_prev = label_lines[k-1]['y'] if k > 0 else None
-        y_next = label_lines[k+1]['y'] if k+1 < len(label_lines) else None
-        upper = mid(y_prev, y_label) if y_prev is not None else y_label - 1e6
-        lower = mid(y_label, y_next) if y_next is not None else y_label + 1e6
-        if y_next is not None:
-            gap = y_next - y_label
-            lower = lower + lower_fudge * max(0, gap)
-
-        vals = []
-        for ln in lines:
-            if upper <= ln['y'] <= lower:
-                vs = [it for it in ln['items'] if it['cls'] == value_cls]
-                if vs:
-                    vals.append(vs)
+        used.update(table.idx[lab['items']].tolist())
         text_segments = []
-        for vs in vals:
-            for it in vs:
-                used.add(it['idx'])
-                value_x_all.append(it['x'])
-            seg = tidy_text(" ".join(it['text'] for it in sorted(vs, key=lambda z:z['x'])))
-            if seg:
-                text_segments.append(seg)
+        for li in line_pos[band_starts[k]:band_starts[k+1]]:
+            vs = line_vals[li]
+            if not vs.size:
+                continue
+            used.update(table.idx[vs].tolist())
+            value_x_all.extend(table.x[vs].tolist())
+            if line_segs[li]:
+                text_segments.append(line_segs[li])
 
         value = tidy_text(" ".join(text_segments))
         if value:
@@ -813,11 +1387,65 @@ def detect_fact_table(tokens, label_cls='styleid3', value_cls='styleid4', y_tol=
         if value_x_med - label_x_med < 0.15 * span:
             return None
 
-    ymin = min(tokens[i]['y'] for i in used) if used else None
-    ymax = max(tokens[i]['y'] for i in used) if used else None
+    ymin = float(table.y[list(used)].min()) if used else None
+    ymax = float(table.y[list(used)].max()) if used else None
     html_table = build_html_table(header=None, rows=rows)
     return {'kind':'fact_2col','header':None,'rows':rows,'html':html_table,'used_idx':used,'ymin':ymin,'ymax':ymax}
 
+def collect_token_table(html_str, css_text, allow_classes=None, parser="lxml", tree=None, positions=None):
+    # tree: optional pre-parsed BeautifulSoup or lxml.html document for html_str
+    # positions: optional precomputed {selector: (y, x)} map; css_text is ignored when given
+    pos = positions if positions is not None else extract_positions_from_css(css_text)
+    if tree is None:
+        tree = BeautifulSoup(html_str, parser)
+    rows = []
+    for sp in _iter_named(tree, 'span'):
+        txt = _node_text(sp, strip=True)
+        if not txt:
+            continue
+        classes = tokens_attr(sp, 'class')
+        style_class = next((c for c in classes if isinstance(c, str) and c.startswith('styleid')), None)
+        if allow_classes is not None and style_class not in allow_classes:
+            continue
+        key = sp.get('id')
+        if key not in pos:
+            for c in classes:
+                if c in pos:
+                    key = c
+                    break
+        if key not in pos:
+            continue
+        y, x = pos[key]
+        rows.append((y, x, style_class, txt))
+    return TokenTable.from_rows(rows)
+
+# ---------- Dict-based token API (wraps the columnar engine) ----------
+
+def collect_tokens(html_str, css_text, allow_classes=None, parser="lxml", tree=None, positions=None):
+    return collect_token_table(html_str, css_text, allow_classes=allow_classes, parser=parser, tree=tree, positions=positions).to_tokens()
+
+def group_by_y(tokens, y_tol=8.0):
+    lines, cur = [], None
+    for t in tokens:
+        if cur is None or abs(t['y'] - cur['y']) > y_tol:
+            cur = {'y': t['y'], 'items': [t]}
+            lines.append(cur)
+        else:
+            cur['items'].append(t)
+    for ln in lines:
+        ln['items'].sort(key=lambda z: z['x'])
+    return lines
+
+def x_span(tokens):
+    xs = [t['x'] for t in tokens]
+    return (min(xs), max(xs), (max(xs) - min(xs)) if xs else 0.0)
+
+def detect_comparison_table(tokens, header_cls='styleid4', label_cls='styleid4', value_cls='styleid5', y_tol=8.0, min_rows=3):
+    return detect_comparison_table_columnar(TokenTable.from_tokens(tokens), header_cls=header_cls, label_cls=label_cls, value_cls=value_cls, y_tol=y_tol, min_rows=min_rows)
+
+def detect_fact_table(tokens, label_cls='styleid3', value_cls='styleid4', y_tol=6.0, lower_fudge=0.30, min_rows=3):
+    return detect_fact_table_columnar(TokenTable.from_tokens(tokens), label_cls=label_cls, value_cls=value_cls, y_tol=y_tol, lower_fudge=lower_fudge, min_rows=min_rows)
+
 def resolve_overlaps(blocks):
     blocks = [b for b in blocks if b]
     if not blocks:
@@ -832,18 +1460,18 @@ def resolve_overlaps(blocks):
             used_all |= b['used_idx']
     return chosen
 
-def render_page_with_tables(html_str, css_text, parser="lxml"):
-    tokens_all = collect_tokens(html_str, css_text, allow_classes=None, parser=parser)
-    if not tokens_all:
+def render_page_with_tables(html_str, css_text, parser="lxml", tree=None, positions=None):
+    tokens_all = collect_token_table(html_str, css_text, allow_classes=None, parser=parser, tree=tree, positions=positions)
+    if not len(tokens_all):
         return "<html><body><!-- no tokens --></body></html>"
 
     blocks = []
     try:
-        blocks.append(detect_comparison_table(tokens_all))
+        blocks.append(detect_comparison_table_columnar(tokens_all))
     except Exception:
         pass
     try:
-        blocks.append(detect_fact_table(tokens_all))
+        blocks.append(detect_fact_table_columnar(tokens_all))
     except Exception:
         pass
     blocks = resolve_overlaps(blocks)
@@ -881,16 +1509,16 @@ def render_page_with_tables(html_str, css_text, parser="lxml"):
     for b in blocks:
         used |= b['used_idx']
 
-    non_table_tokens = [t for t in tokens_all if t['idx'] not in used]
-    lines = group_by_y(non_table_tokens, y_tol=8.0)
+    non_table_rows = np.flatnonzero(~np.isin(tokens_all.idx, list(used)))
+    lines = group_token_lines(tokens_all, non_table_rows, y_tol=8.0)
 
     items = []
-    for ln in lines:
-        text = tidy_text(" ".join(x['text'] for x in ln['items']))
+    for line_y, line_rows in lines:
+        text = tokens_all.join_text(line_rows)
         if text:
-            items.append({'y': ln['y'], 'html': f"<p>{ihtml.escape(text)}</p>"})
+            items.append({'y': line_y, 'html': f"<p>{ihtml.escape(text)}</p>"})
     for b in blocks:
-        ymid = (b['ymin'] + b['ymax'])/2.0 if (b['ymin'] is not None and b['ymax'] is not None) else min(t['y'] for t in tokens_all)
+        ymid = (b['ymin'] + b['ymax'])/2.0 if (b['ymin'] is not None and b['ymax'] is not None) else float(tokens_all.y.min())
         items.append({'y': ymid, 'html': b['html']})
 
     items.sort(key=lambda x: x['y'])
@@ -900,28 +1528,87 @@ def render_page_with_tables(html_str, css_text, parser="lxml"):
     out.append("</body></html>")
     return "\n".join(out)
 
-def read_linked_css(html_path: str, soup: BeautifulSoup) -> str:
-    base = Path(html_path).parent
-    css_texts = []
-    for link in soup.find_all("link", rel=True):
+def _stylesheet_hrefs(soup: Any) -> List[str]:
+    hrefs = []
+    for link in _iter_named(soup, "link"):
+        if link.get("rel") is None:
+            continue
         rels = tokens_attr(link, 'rel')
         if "stylesheet" in rels:
             href = link.get("href")
-            if not href:
-                continue
-            css_path = (base / href).resolve()
-            if css_path.exists():
-                try:
-                    css_texts.append(css_path.read_text(encoding="utf-8", errors="ignore"))
-                except Exception:
-                    pass
-    return "\n\n".join(css_texts)
+            if href:
+                hrefs.append(href)
+    return hrefs
+
+def read_linked_stylesheets(html_path: str, soup: Any) -> List[Tuple[Path, str]]:
+    return _load_stylesheets(html_path, _stylesheet_hrefs(soup))
 
-def _read_inline_css_from_style_tags(soup: BeautifulSoup) -> str:
+def _load_stylesheets(html_path: str, hrefs: List[str]) -> List[Tuple[Path, str]]:
+    base = Path(html_path).parent
+    sheets = []
+    for href in hrefs:
+        css_path = (base / href).resolve()
+        if css_path.exists():
+            try:
+                sheets.append((css_path, css_path.read_text(encoding="utf-8", errors="ignore")))
+            except Exception:
+                pass
+    return sheets
+
+def read_archive_stylesheets(zin: zipfile.ZipFile, member: str, soup: Any) -> List[Tuple[str, str]]:
+    """read_linked_stylesheets for a chapter inside an open archive; hrefs resolve against member's folder."""
+    return _load_archive_stylesheets(zin, member, _stylesheet_hrefs(soup))
+
+def _load_archive_stylesheets(zin: zipfile.ZipFile, member: str, hrefs: List[str]) -> List[Tuple[str, str]]:
+    base = posixpath.dirname(member)
+    sheets = []
+    for href in hrefs:
+        name = posixpath.normpath(posixpath.join(base, href))
+        try:
+            data = zin.read(name)
+        except Exception:
+            # KeyError for hrefs that point outside the archive
+            continue
+        text = _universal_newlines(data.decode("utf-8", errors="ignore"))
+        sheets.append((f"{zin.filename or id(zin)}!{name}", text))
+    return sheets
+
+def read_linked_css(html_path: str, soup: Any) -> str:
+    return "\n\n".join(css for _, css in read_linked_stylesheets(html_path, soup))
+
+# ---------- Linked stylesheet position cache ----------
+# Fixed-layout books link the same few stylesheets from every page, so the parsed
+# {selector: (y, x)} map is kept per (path, content hash) and reused across chapters.
+# Content hashing keeps entries valid even if a path is reused by another book.
+
+STYLESHEET_CACHE_SIZE = 256
+_stylesheet_positions: "OrderedDict[Tuple[str, str], Dict[str, Tuple[float, float]]]" = OrderedDict()
+_stylesheet_lock = threading.Lock()
+
+def stylesheet_positions(css_path: Union[Path, str], css_text: str) -> Dict[str, Tuple[float, float]]:
+    """Positions declared by one linked stylesheet; callers must not mutate the result."""
+    key = (str(css_path), hashlib.sha1(css_text.encode("utf-8", "ignore")).hexdigest())
+    with _stylesheet_lock:
+        cached = _stylesheet_positions.get(key)
+        if cached is not None:
+            _stylesheet_positions.move_to_end(key)
+            return cached
+    positions = extract_positions_from_css(css_text)
+    with _stylesheet_lock:
+        _stylesheet_positions[key] = positions
+        while len(_stylesheet_positions) > STYLESHEET_CACHE_SIZE:
+            _stylesheet_positions.popitem(last=False)
+    return positions
+
+def clear_stylesheet_cache() -> None:
+    with _stylesheet_lock:
+        _stylesheet_positions.clear()
+
+def _read_inline_css_from_style_tags(soup: Any) -> str:
     css_chunks = []
-    for st in soup.find_all("style"):
+    for st in _iter_named(soup, "style"):
         try:
-            txt = st.get_text() or ""
+            txt = _node_text(st) or ""
             if txt.strip():
                 css_chunks.append(txt)
         except Exception:
@@ -956,12 +1643,16 @@ def _table_to_ol_if_numbered(tb: Any) -> Optional[str]:
     return build_html_ol(items, start=start)
 
 def _build_ptable_stream_from_dom(html_str: str) -> str:
-    s = BeautifulSoup(html_str, 'html.parser')
+    return _build_ptable_stream_from_dom_tree(BeautifulSoup(html_str, 'html.parser'))
+
+
+def _build_ptable_stream_from_dom_tree(s: BeautifulSoup) -> str:
     body = s.body or s
     parts: List[str] = []
 
     def sanitize_table(tb):
-        clone = BeautifulSoup(str(tb), 'html.parser').table
+        # copy.copy() on a Tag is a deep copy, so the shared source tree stays untouched
+        clone = copy.copy(tb)
         if clone:
             cls = clone.get('class') or []
             if 'text-hidden' not in cls:
@@ -987,22 +1678,44 @@ def _build_ptable_stream_from_dom(html_str: str) -> str:
     return "\n".join(parts)
 
 
-def _build_ptable_stream_from_css(input_path: Path) -> str:
+def _build_ptable_stream_from_css(input_path: Path, parser_backend: str = DEFAULT_PARSER_BACKEND) -> str:
     try:
         html_str = input_path.read_text(encoding='utf-8', errors='ignore')
     except Exception:
         return ""
+    return _build_ptable_stream_from_css_html(
+        html_str, lambda hrefs: _load_stylesheets(str(input_path), hrefs), parser_backend)
+
+
+def _build_ptable_stream_from_css_html(
+    html_str: str,
+    load_stylesheets: Callable[[List[str]], List[Tuple[Union[Path, str], str]]],
+    parser_backend: str = DEFAULT_PARSER_BACKEND
+) -> str:
+    """load_stylesheets(hrefs) returns [(cache_key, css_text)] for the page's <link> sheets that exist."""
     parser = "lxml"
-    soup = BeautifulSoup(html_str, parser)
-    css_ext = ""
+    if parser_backend == "lxml":
+        try:
+            tree = _parse_lxml_native(html_str)
+        except Exception:
+            # lxml refuses empty documents
+            return ""
+    else:
+        tree = BeautifulSoup(html_str, parser)
+    linked = []
     try:
-        css_ext = read_linked_css(str(input_path), soup) or ""
+        linked = load_stylesheets(_stylesheet_hrefs(tree))
     except Exception:
         pass
-    css_inline = _read_inline_css_from_style_tags(soup)
-    css_text = "\n\n".join(x for x in (css_ext, css_inline) if x.strip())
+    css_inline = _read_inline_css_from_style_tags(tree)
     try:
-        page_html = render_page_with_tables(html_str, css_text, parser=parser)
+        # linked sheets come from the cache; only this page's <style> blocks are parsed here
+        positions: Dict[str, Tuple[float, float]] = {}
+        for css_path, css_src in linked:
+            positions.update(stylesheet_positions(css_path, css_src))
+        if css_inline.strip():
+            positions.update(extract_positions_from_css(css_inline))
+        page_html = render_page_with_tables(html_str, "", parser=parser, tree=tree, positions=positions)
     except Exception:
         return ""
     bs = BeautifulSoup(page_html, 'html.parser')
@@ -1034,9 +1747,12 @@ def extract_structured_dom_from_html(html_src: str, feature_titles: Optional[Lis
     - If a <h2> or <p> matches feature_titles exactly (case-insensitive), treat as a feature and create an <aside>.
     - Short paragraphs with heading-like classes become <h2>.
     """
+    return extract_structured_dom_from_tree(BeautifulSoup(html_src, 'html.parser'), feature_titles=feature_titles)
+
+
+def extract_structured_dom_from_tree(soup: BeautifulSoup, feature_titles: Optional[List[str]] = None) -> str:
     feature_titles = feature_titles or []
     ft_norm = {re.sub(r"\s+", " ", (t or "").strip()).lower() for t in feature_titles if t and t.strip()}
-    soup = BeautifulSoup(html_src, 'html.parser')
     container = soup.select_one('#PageContainer') or soup.select_one('.PageContainer') or soup.body or soup
     result_parts: List[str] = []
 
@@ -1050,8 +1766,8 @@ def extract_structured_dom_from_html(html_src: str, feature_titles: Optional[Lis
         if not getattr(node, "name", None):
             continue
         tag = node.name.lower()
-        text = flatten_paragraph(node)
         if tag in ("h2", "p"):
+            text = flatten_paragraph(node)
             # feature check: exact match to feature_titles
             if text and text.lower() in ft_norm:
                 title = text.strip()
@@ -1063,7 +1779,7 @@ def extract_structured_dom_from_html(html_src: str, feature_titles: Optional[Lis
                 if sibling and getattr(sibling, "name", "").lower() == "p":
                     next_p = flatten_paragraph(sibling)
                 # compose aside
-                aid = f"feat-{abs(hash(title)) % (10**8)}"
+                aid = f"feat-{hashlib.sha1(title.encode('utf-8')).hexdigest()[:8]}"
                 phtml = next_p or ""
                 aside_html = f'<aside aria-labelledby="{aid}"><h2 class="text-hidden" id="{aid}">{html_escape(title)}</h2><p class="text-hidden">{html_escape(phtml)}</p></aside>'
                 result_parts.append(aside_html)
@@ -1101,79 +1817,301 @@ def extract_structured_dom_from_html(html_src: str, feature_titles: Optional[Lis
     return "".join(result_parts)
 
 
-# ---------- High-level process_file & process_folder ----------
+# ---------- EPUB repack ----------
+# Members process_epub leaves unpatched are copied byte-for-byte from the source
+# archive (compressed data is never inflated).
 
-def process_file(
-    input_file: Path,
-    output_folder: Path,
-    feature_titles: Optional[List[str]] = None,
-    h1_candidates: Optional[List[str]] = None,
-    patch_enabled: bool = True,
-    backup_enabled: bool = False
-) -> Dict[str, Any]:
+def _strip_zip64_extra(extra: bytes) -> bytes:
+    # FileHeader() appends its own zip64 field, so drop any copied from the source
+    out = []
+    i = 0
+    while i + 4 <= len(extra):
+        header_id, size = struct.unpack("<HH", extra[i:i+4])
+        if header_id != 1:
+            out.append(extra[i:i+4+size])
+        i += 4 + size
+    return b"".join(out)
+
+def _copy_zip_member_raw(zin: zipfile.ZipFile, zout: zipfile.ZipFile, info: zipfile.ZipInfo, arcname: Optional[str] = None) -> None:
+    src = zin.fp
+    src.seek(info.header_offset + 26)
+    name_len, extra_len = struct.unpack("<HH", src.read(4))
+    src.seek(info.header_offset + 30 + name_len + extra_len)
+
+    out = copy.copy(info)
+    if arcname is not None:
+        out.filename = out.orig_filename = arcname
+    out.flag_bits &= ~0x08  # CRC and sizes are known, so no trailing data descriptor
+    out.extra = _strip_zip64_extra(info.extra)
+    out.header_offset = zout.fp.tell()
+    zip64 = out.file_size > zipfile.ZIP64_LIMIT or out.compress_size > zipfile.ZIP64_LIMIT
+    zout.fp.write(out.FileHeader(zip64))
+    remaining = info.compress_size
+    while remaining:
+        chunk = src.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member {info.filename!r}")
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+    zout.filelist.append(out)
+    zout.NameToInfo[out.filename] = out
+    zout.start_dir = zout.fp.tell()
+
+# ---------- Chapter result cache ----------
+# A chapter's pipeline result depends on its markup, name, options, parser backend and
+# the linked stylesheets it reads. Entries are keyed by everything but the stylesheets;
+# those are recorded in the entry (hrefs + content digest) and re-checked on every hit,
+# since finding the <link>s in the first place would need a parse.
+# Bump PIPELINE_VERSION whenever a change to the pipeline changes its output.
+
+PIPELINE_VERSION = "6"
+
+def result_cache_key(html_src: str, name: str, feature_titles: List[str], h1_candidates: List[str], parser_backend: str) -> str:
+    h = hashlib.sha256()
+    for part in (PIPELINE_VERSION, parser_backend, name, json.dumps(feature_titles), json.dumps(h1_candidates), html_src):
+        h.update(part.encode("utf-8", "surrogatepass"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _stylesheets_digest(sheets: List[Tuple[Union[Path, str], str]]) -> str:
+    h = hashlib.sha256()
+    for _, css_text in sheets:
+        h.update(hashlib.sha256(css_text.encode("utf-8", "surrogatepass")).digest())
+    return h.hexdigest()
+
+def _stylesheets_unchanged(deps: Optional[Dict[str, Any]], load_stylesheets: Callable[[List[str]], List[Tuple[Union[Path, str], str]]]) -> bool:
+    """Whether the linked CSS a result recorded as deps (a doc's "stylesheets") still reads the same."""
+    try:
+        return not deps or _stylesheets_digest(load_stylesheets(deps["hrefs"])) == deps["digest"]
+    except Exception:
+        return False
+
+class ResultCache:
     """
-    Process one HTML/XHTML file:
-      - produce patched HTML (in-place if patch_enabled via patch_source_file),
-      - produce a cleaned reading-order HTML and TXT into output_folder
-      - return metadata dict used in Excel report
+    Content-addressed on-disk cache of per-chapter pipeline results, safe to share
+    between processes. Hits refresh an entry's mtime; once roughly a tenth of
+    max_bytes has been written, trim() drops least recently used entries until
+    the cache is back under 90% of max_bytes. Writes are counted per instance, so
+    whoever hands pickled copies to a process pool calls trim() once they're done.
     """
-    feature_titles = feature_titles or []
-    h1_candidates = h1_candidates or []
-    footer_text = None
 
+    def __init__(self, root: Union[Path, str], max_bytes: int = 256 << 20):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._written = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as fh:
+                entry = json.load(fh)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        path = self._path(key)
+        data = json.dumps(entry).encode("utf-8")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        self._written += len(data)
+        if self._written > self.max_bytes // 10:
+            self.trim()
+
+    def trim(self) -> None:
+        self._written = 0
+        entries = []
+        for path in self.root.glob("*/*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 9 // 10
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+# ---------- Spine discovery ----------
+# Chapters are the OPF spine's content documents, in reading order: container.xml
+# names the package document, whose manifest maps spine idrefs to hrefs.
+
+SPINE_MEDIA_TYPES = ("application/xhtml+xml", "text/html")
+_XML_PARSER = lxml.etree.XMLParser(resolve_entities=False, no_network=True, recover=True)
+
+def _xml_descendants(el: Any, local_name: str) -> List[Any]:
+    return [c for c in el.iter() if isinstance(c.tag, str) and lxml.etree.QName(c).localname == local_name]
+
+def spine_documents(read: Callable[[str], Optional[bytes]]) -> Optional[List[str]]:
+    """
+    Root-relative posix paths of the spine's content documents, in spine order.
+    read(path) returns a file's bytes or None. None if there is no usable spine.
+    """
     try:
-        html_src = input_file.read_text(encoding="utf-8", errors="ignore")
+        container = read("META-INF/container.xml")
+        if not container:
+            return None
+        rootfiles = [r.get("full-path") for r in _xml_descendants(lxml.etree.fromstring(container, _XML_PARSER), "rootfile")]
+        opf_path = next((r for r in rootfiles if r), None)
+        opf = read(opf_path) if opf_path else None
+        if not opf:
+            return None
+        package = lxml.etree.fromstring(opf, _XML_PARSER)
     except Exception:
-        html_src = ""
+        return None
 
-    # 1) Extract structured DOM snippet (mimic Playwright extraction)
-    structured_dom = extract_structured_dom_from_html(html_src, feature_titles=feature_titles)
+    opf_dir = posixpath.dirname(opf_path)
+    manifest = {}
+    for item in _xml_descendants(package, "item"):
+        href = item.get("href")
+        if item.get("id") and href and item.get("media-type") in SPINE_MEDIA_TYPES:
+            manifest[item.get("id")] = posixpath.normpath(posixpath.join(opf_dir, unquote(href.split("#", 1)[0])))
+    docs: List[str] = []
+    for itemref in _xml_descendants(package, "itemref"):
+        path = manifest.get(itemref.get("idref"))
+        if path and path not in docs:
+            docs.append(path)
+    return docs or None
+
+def _read_file_or_none(root: Path, name: str) -> Optional[bytes]:
+    try:
+        return (root / name).read_bytes()
+    except OSError:
+        return None
 
-    # 2) Build table stream using DOM or CSS
-    dom_has_table = bool(BeautifulSoup(html_src or "", 'html.parser').find('table'))
-    use_dom_tables_only = False
-    if dom_has_table:
-        ptable_stream = _build_ptable_stream_from_dom(html_src)
-        use_dom_tables_only = True
-    else:
-        # fallback to css-based detection
-        ptable_stream = _build_ptable_stream_from_css(input_file)
+# ---------- Stage timings & profiling ----------
+# Every processed file carries a StageTimings in its report row: wall and CPU time of
+# each pipeline stage, plus the size of what the stage consumed and produced.
+# process_folder/process_epub(stage_timings=True) add them as report columns, and
+# profiler= runs each file under one of PROFILERS.
+
+PIPELINE_STAGES = ("Read", "Cache", "Parse", "StructuredDom", "TableStream", "Merge", "PostProcess",
+                   "H1", "Compose", "Write", "Patch", "Total")
 
-    # 3) Merge streams similar to original
-    dom_soup = BeautifulSoup(structured_dom, 'html.parser')
-    top_level_kept: List[str] = []
-    for child in list(dom_soup.contents):
+class StageTimings:
+    """
+    Per-stage {"wall_ms", "cpu_ms", "in", "out"} for one file, in run order. Sizes are
+    len() of the stage's input/output: characters for markup and text, nodes for a
+    parsed tree, None where a stage has no natural size. CPU time is the calling
+    thread's, so jobs sharing a process do not count each other's work. Node counts
+    walk whole trees, so they are only taken with count_nodes.
+    """
+
+    def __init__(self, count_nodes: bool = False):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.count_nodes = count_nodes
+
+    @contextmanager
+    def stage(self, name: str, size_in: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        rec: Dict[str, Any] = {"wall_ms": 0.0, "cpu_ms": 0.0, "in": size_in, "out": None}
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield rec
+        finally:
+            rec["wall_ms"] = (time.perf_counter() - wall) * 1000
+            rec["cpu_ms"] = (time.thread_time() - cpu) * 1000
+            self.stages[name] = rec
+
+    def as_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {name: dict(rec) for name, rec in self.stages.items()}
+
+    def tree_size(self, soup: Any) -> Optional[int]:
+        return sum(1 for _ in soup.descendants) if self.count_nodes else None
+
+
+@contextmanager
+def _cprofile_to(path: Path) -> Iterator[None]:
+    import cProfile
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(str(path.with_suffix(".prof")))
+
+@contextmanager
+def _pyinstrument_to(path: Path) -> Iterator[None]:
+    from pyinstrument import Profiler
+    prof = Profiler()
+    prof.start()
+    try:
+        yield
+    finally:
+        prof.stop()
+        path.with_suffix(".html").write_text(prof.output_html(), encoding="utf-8")
+
+# name -> factory(path) giving a context manager that profiles its body and writes
+# the result next to path (extension added by the profiler). Register more here;
+# pool workers see the names registered at import time. pyinstrument is only
+# offered when it is installed, so asking for it otherwise fails before any file runs.
+PROFILERS: Dict[str, Callable[[Path], ContextManager[None]]] = {
+    "cprofile": _cprofile_to,
+}
+if importlib.util.find_spec("pyinstrument") is not None:
+    PROFILERS["pyinstrument"] = _pyinstrument_to
+
+def _check_profiler(profiler: Optional[str]) -> None:
+    if profiler is not None and profiler not in PROFILERS:
+        raise ValueError(f"Unknown profiler {profiler!r}; expected one of {tuple(PROFILERS)}")
+
+def _profiled(profiler: Optional[str], output_folder: Path, stem: str) -> ContextManager[None]:
+    """Profile one file into output_folder/<stem>-profile.<ext>, or do nothing without a profiler."""
+    if profiler is None:
+        return nullcontext()
+    _check_profiler(profiler)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    return PROFILERS[profiler](output_folder / f"{stem}-profile")
+
+
+# ---------- High-level process_file & process_folder ----------
+
+def _compose_stream_tree(structured_dom: str, ptable_stream: str, use_dom_tables_only: bool) -> BeautifulSoup:
+    """
+    Build the merged reading stream as a single tree: top-level structured DOM
+    elements (minus <p> on the CSS path) followed by the table stream.
+    Produces the same tree as parsing "\n".join(kept + [ptable_stream]).
+    """
+    soup = BeautifulSoup(structured_dom, 'html.parser')
+    if not ptable_stream.strip():
+        return soup
+
+    kept = []
+    for child in list(soup.contents):
+        child.extract()
         if getattr(child, 'name', None) is None:
             continue
-        tag = child.name.lower()
-        if tag == 'p' and not use_dom_tables_only:
+        if child.name.lower() == 'p' and not use_dom_tables_only:
             # in original logic they removed p only when using CSS path; we keep p if we used DOM tables
-            child.extract()
-        else:
-            top_level_kept.append(str(child))
-
-    merged_stream = ""
-    if ptable_stream.strip():
-        merged_stream = "\n".join(top_level_kept + [ptable_stream])
-    else:
-        merged_stream = structured_dom
-
-    # 4) Post-process: merges, lists, paragraphs end punctuation, footer
-    merged_stream = merge_outside_p_after_aside(merged_stream)
-    merged_stream = convert_paragraphs_to_lists(merged_stream)
-    merged_stream = ensure_paragraphs_end_with_dot(merged_stream)
-    merged_stream, footer_html, page_num = move_page_number_to_footer(merged_stream)
-    footer_text = page_num or None
+            continue
+        kept.append(child)
 
-    # 5) Optional H1 injection
-    merged_stream, chosen_h1 = inject_h1_for_runtime_match(merged_stream, h1_candidates)
-    text_content = recompute_text_from_html_fragment(merged_stream)
+    for child in kept:
+        soup.append(child)
+        soup.append(NavigableString("\n"))
+    for child in list(BeautifulSoup(ptable_stream, 'html.parser').contents):
+        soup.append(child.extract())
+    return _settle_whitespace(soup)
 
-    hgroup_html = ""
-    if chosen_h1:
-        hgroup_html = f"<hgroup>\n<h1 class=\"text-hidden\">{html_escape(chosen_h1)}</h1>\n</hgroup>\n"
 
-    # 6) Compose final preview HTML (cleaned)
+def _reading_order_page(page_title: Any, hgroup_html: str, merged_stream: str, footer_html: str) -> str:
     styles = """
 .text-hidd {
   position: absolute !important;
@@ -1191,8 +2129,7 @@ figcaption p.text-hidden { margin: 0; }
 aside { display: block; border: 1px solid #cfd8dc; border-radius: 6px; padding: 16px; margin: 24px 0; background: #f6fbff; }
 """
 
-    page_title = BeautifulSoup(html_src, 'html.parser').title.string if BeautifulSoup(html_src, 'html.parser').title else input_file.name
-    result_html = f"""<!DOCTYPE html>
+    return f"""<!DOCTYPE html>
 <html lang='en'>
 <head>
 <meta charset='utf-8'>
@@ -1207,47 +2144,489 @@ aside { display: block; border: 1px solid #cfd8dc; border-radius: 6px; padding:
 </body>
 </html>"""
 
-    # 7) Write reading-order outputs
+
+def _process_html(
+    html_src: str,
+    name: str,
+    load_stylesheets: Callable[[List[str]], List[Tuple[Union[Path, str], str]]],
+    feature_titles: List[str],
+    h1_candidates: List[str],
+    parser_backend: str,
+    timings: Optional[StageTimings] = None
+) -> Dict[str, Any]:
+    """
+    Source-agnostic core of process_file: runs the pipeline on one chapter's markup
+    and returns the reading-order HTML/TXT, insertion fragment and footer info.
+    "stylesheets" records the linked CSS the result depends on (None if no CSS was read).
+    Stage timings go to timings if given; they are not part of the (cacheable) result.
+    """
+    timings = timings if timings is not None else StageTimings()
+    stylesheets: Dict[str, Any] = {}
+
+    def load_and_record(hrefs: List[str]) -> List[Tuple[Union[Path, str], str]]:
+        sheets = load_stylesheets(hrefs)
+        stylesheets.update(hrefs=hrefs, digest=_stylesheets_digest(sheets))
+        return sheets
+
+    # The chapter is parsed once; every source-side stage below reads this tree
+    with timings.stage("Parse", len(html_src)) as st:
+        src_soup = parse_document(html_src, parser_backend)
+        st["out"] = src_size = timings.tree_size(src_soup)
+
+    # 1) Extract structured DOM snippet (mimic Playwright extraction)
+    with timings.stage("StructuredDom", src_size) as st:
+        structured_dom = extract_structured_dom_from_tree(src_soup, feature_titles=feature_titles)
+        st["out"] = len(structured_dom)
+
+    # 2) Build table stream using DOM or CSS
+    with timings.stage("TableStream") as st:
+        dom_has_table = bool(src_soup.find('table'))
+        use_dom_tables_only = False
+        if dom_has_table:
+            st["in"] = src_size
+            ptable_stream = _build_ptable_stream_from_dom_tree(src_soup)
+            use_dom_tables_only = True
+        else:
+            # fallback to css-based detection
+            st["in"] = len(html_src)
+            ptable_stream = _build_ptable_stream_from_css_html(html_src, load_and_record, parser_backend)
+        st["out"] = len(ptable_stream)
+
+    # 3) Merge streams similar to original (into one live tree)
+    with timings.stage("Merge", len(structured_dom) + len(ptable_stream)) as st:
+        stream = _compose_stream_tree(structured_dom, ptable_stream, use_dom_tables_only)
+        st["out"] = stream_size = timings.tree_size(stream)
+
+    # 4) Post-process: merges, lists, paragraphs end punctuation, footer
+    # (one text cache follows the tree through all four stages)
+    with timings.stage("PostProcess", stream_size) as st:
+        texts = TextCache()
+        stream = merge_outside_p_after_aside_tree(stream, texts)
+        stream = convert_paragraphs_to_lists_tree(stream, texts=texts)
+        stream = ensure_paragraphs_end_with_dot_tree(stream, texts)
+        stream, footer_html, page_num = move_page_number_to_footer_tree(stream, texts)
+        st["out"] = stream_size = timings.tree_size(stream)
+
+    # 5) Optional H1 injection
+    with timings.stage("H1", stream_size):
+        stream, chosen_h1 = inject_h1_for_runtime_match_tree(stream, h1_candidates)
+
+    # 6) Compose final preview HTML (cleaned)
+    with timings.stage("Compose", stream_size) as st:
+        merged_stream = str(stream)
+        text_content = recompute_text_from_tree(stream)
+
+        hgroup_html = ""
+        if chosen_h1:
+            hgroup_html = f"<hgroup>\n<h1 class=\"text-hidden\">{html_escape(chosen_h1)}</h1>\n</hgroup>\n"
+
+        page_title = src_soup.title.string if src_soup.title else name
+        result_html = _reading_order_page(page_title, hgroup_html, merged_stream, footer_html)
+        insertion_fragment = build_insertion_fragment(hgroup_html, merged_stream, footer_html)
+        st["out"] = len(result_html)
+
+    return {
+        "result_html": result_html,
+        "text_content": text_content,
+        "insertion_fragment": insertion_fragment,
+        "footer_html": footer_html,
+        "page_num": page_num,
+        "stylesheets": stylesheets or None
+    }
+
+
+def _process_html_cached(
+    result_cache: Optional[ResultCache],
+    html_src: str,
+    name: str,
+    load_stylesheets: Callable[[List[str]], List[Tuple[Union[Path, str], str]]],
+    feature_titles: List[str],
+    h1_candidates: List[str],
+    parser_backend: str,
+    timings: Optional[StageTimings] = None
+) -> Dict[str, Any]:
+    args = (html_src, name, load_stylesheets, feature_titles, h1_candidates, parser_backend, timings)
+    if result_cache is None:
+        return _process_html(*args)
+    timings = timings if timings is not None else StageTimings()
+    with timings.stage("Cache", len(html_src)) as st:
+        key = result_cache_key(html_src, name, feature_titles, h1_candidates, parser_backend)
+        doc = result_cache.get(key)
+        if doc is not None and _stylesheets_unchanged(doc.get("stylesheets"), load_stylesheets):
+            st["out"] = len(doc["result_html"])
+            return doc
+    doc = _process_html(*args)
+    result_cache.put(key, doc)
+    return doc
+
+
+def _write_reading_order(output_folder: Path, stem: str, doc: Dict[str, Any]) -> Tuple[Path, Path]:
     output_folder.mkdir(parents=True, exist_ok=True)
-    output_html = output_folder / f"{input_file.stem}-reading-order.html"
-    output_txt = output_folder / f"{input_file.stem}-reading-order.txt"
+    output_html = output_folder / f"{stem}-reading-order.html"
+    output_txt = output_folder / f"{stem}-reading-order.txt"
     try:
-        output_html.write_text(result_html, encoding='utf-8')
-        output_txt.write_text(text_content, encoding='utf-8')
+        output_html.write_text(doc["result_html"], encoding='utf-8')
+        output_txt.write_text(doc["text_content"], encoding='utf-8')
     except Exception:
         # fallback to latin-1 if some exotic encoding
-        output_html.write_text(result_html, encoding='latin-1', errors='ignore')
-        output_txt.write_text(text_content, encoding='latin-1', errors='ignore')
+        output_html.write_text(doc["result_html"], encoding='latin-1', errors='ignore')
+        output_txt.write_text(doc["text_content"], encoding='latin-1', errors='ignore')
+    return output_html, output_txt
 
-    # 8) Patch original source if requested (safe insertion)
-    patched = False
-    patch_note = ""
-    if patch_enabled:
-        insertion_fragment = build_insertion_fragment(hgroup_html, merged_stream, footer_html)
-        patched, patch_note = patch_source_file(
-            original_path=input_file,
-            insertion_fragment_html=insertion_fragment,
-            insert_after_id="parent-p1",
-            backup=backup_enabled
-        )
 
-    # 9) Return report row info
+def _report_row(input_name: str, output_html: Path, output_txt: Path, doc: Dict[str, Any], patched: bool, patch_note: str, timings: StageTimings) -> Dict[str, Any]:
     return {
-        "input_file": str(input_file),
+        "input_file": input_name,
         "output_html": str(output_html),
         "output_txt": str(output_txt),
-        "has_footer": bool(footer_html.strip()),
-        "page_number": page_num or "",
+        "has_footer": bool(doc["footer_html"].strip()),
+        "page_number": doc["page_num"] or "",
         "patched": patched,
-        "patch_note": patch_note
+        "patch_note": patch_note,
+        "stylesheets": doc.get("stylesheets"),
+        "timings": timings.as_dict()
     }
 
 
+def process_file(
+    input_file: Path,
+    output_folder: Path,
+    feature_titles: Optional[List[str]] = None,
+    h1_candidates: Optional[List[str]] = None,
+    patch_enabled: bool = True,
+    backup_enabled: bool = False,
+    parser_backend: str = DEFAULT_PARSER_BACKEND,
+    result_cache: Optional[ResultCache] = None,
+    profiler: Optional[str] = None,
+    insert_after_id: str = "parent-p1",
+    stage_timings: bool = False
+) -> Dict[str, Any]:
+    """
+    Process one HTML/XHTML file:
+      - produce patched HTML (in-place if patch_enabled via patch_source_file),
+      - produce a cleaned reading-order HTML and TXT into output_folder
+      - return metadata dict used in the report ("timings": StageTimings of this file)
+    With a result_cache, an unchanged chapter skips the pipeline and only writes outputs.
+    profiler names one of PROFILERS to profile the file into output_folder.
+    insert_after_id is the element the patched block goes into (see patch_source_file).
+    stage_timings also counts the tree nodes each stage consumed and produced.
+    """
+    timings = StageTimings(count_nodes=stage_timings)
+    with _profiled(profiler, output_folder, input_file.stem), timings.stage("Total"):
+        with timings.stage("Read") as st:
+            try:
+                html_src = strip_injected_block(input_file.read_text(encoding="utf-8", errors="ignore"))
+            except Exception:
+                html_src = ""
+            st["out"] = len(html_src)
+
+        doc = _process_html_cached(
+            result_cache,
+            html_src,
+            input_file.name,
+            lambda hrefs: _load_stylesheets(str(input_file), hrefs),
+            feature_titles or [],
+            h1_candidates or [],
+            parser_backend,
+            timings
+        )
+        with timings.stage("Write", len(doc["result_html"]) + len(doc["text_content"])):
+            output_html, output_txt = _write_reading_order(output_folder, input_file.stem, doc)
+
+        # Patch original source if requested (safe insertion)
+        patched = False
+        patch_note = ""
+        if patch_enabled:
+            with timings.stage("Patch", len(doc["insertion_fragment"])):
+                patched, patch_note = patch_source_file(
+                    original_path=input_file,
+                    insertion_fragment_html=doc["insertion_fragment"],
+                    insert_after_id=insert_after_id,
+                    backup=backup_enabled
+                )
+
+    return _report_row(str(input_file), output_html, output_txt, doc, patched, patch_note, timings)
+
+
 def _collect_files(input_folder: Path) -> List[Path]:
+    spine = spine_documents(lambda name: _read_file_or_none(input_folder, name))
+    if spine:
+        files = [input_folder / name for name in spine if (input_folder / name).is_file()]
+        if files:
+            return files
+    # no OPF spine (or none of it on disk): every HTML/XHTML file, by path
     files = list(input_folder.rglob("*.xhtml")) + list(input_folder.rglob("*.html"))
     return sorted(files, key=lambda p: str(p).lower())
 
 
+# ---------- Incremental rebuild manifest ----------
+# process_folder(manifest_path=...) records, per file (relative to the input folder),
+# the sha256 the file had when the run finished - i.e. after in-place patching - and
+# its report row, which includes the linked stylesheets the result read. On the next run
+# with the same options, a file still carrying that hash whose stylesheets still read the
+# same is exactly what the previous run left behind, so its outputs and row are reused.
+
+MANIFEST_VERSION = 2
+
+def _file_digest(path: Path) -> Optional[str]:
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+def _load_manifest(manifest_path: Path, options: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(manifest_path, encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION or manifest.get("options") != options:
+        return {}
+    return manifest.get("files") or {}
+
+def _write_manifest(manifest_path: Path, options: Dict[str, Any], files: Dict[str, Dict[str, Any]]) -> None:
+    tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+    try:
+        tmp.write_text(json.dumps({"version": MANIFEST_VERSION, "options": options, "files": files}), encoding="utf-8")
+        os.replace(tmp, manifest_path)
+    except OSError:
+        pass
+
+def _reuse_outputs(row: Dict[str, Any], input_file: Path, output_folder: Path) -> Optional[Dict[str, Any]]:
+    """The previous report row for input_file (no stage timings: nothing ran) with its outputs in output_folder, or None if they are gone."""
+    reused = dict(row, input_file=str(input_file), timings={})
+    for key in ("output_html", "output_txt"):
+        old = Path(row[key])
+        new = output_folder / old.name
+        try:
+            if not old.exists():
+                return None
+            if new.resolve() != old.resolve():
+                output_folder.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(old, new)
+        except OSError:
+            return None
+        reused[key] = str(new)
+    return reused
+
+
+# One process pool per Python process, shared by every job running in it, so concurrent
+# jobs split `workers` processes rather than each starting its own. Children come from a
+# forkserver (with this module preloaded): forking a threaded web worker directly can copy
+# locks other threads hold. As with any spawned children, scripts that use workers > 1
+# must guard their entry point with `if __name__ == "__main__"`.
+_pool: Any = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def _process_pool(workers: int) -> Any:
+    # Caller holds _pool_lock and submits under it, so growing the pool never shuts one
+    # down while another job is still queueing work on it
+    global _pool, _pool_workers
+    if _pool is None or workers > _pool_workers:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        if _pool is not None:
+            # jobs already queued on the smaller pool still finish there
+            _pool.shutdown(wait=False)
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        _pool_workers = workers
+    return _pool
+
+def _drop_process_pool(pool: Any, wait: bool = False) -> None:
+    # once it is no longer _pool nobody can submit to it, so it can shut down unlocked
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is pool:
+            _pool, _pool_workers = None, 0
+    pool.shutdown(wait=wait)
+
+
+def _run_in_order(
+    fn: Callable[..., Any],
+    jobs: List[Dict[str, Any]],
+    names: List[str],
+    workers: int,
+    report: Callable[[int, str, str], None]
+) -> Iterator[Any]:
+    """
+    Yield fn(**job) for each job, in job order. workers > 1 runs the jobs on the shared
+    process pool (fn and jobs must pickle); finished results wait until earlier ones arrive.
+    """
+    if workers <= 1:
+        for idx, job in enumerate(jobs, start=1):
+            report(idx-1, "Starting", names[idx-1])
+            result = fn(**job)
+            report(idx, "Processed", names[idx-1])
+            yield result
+        return
+
+    from concurrent.futures import as_completed
+    from concurrent.futures.process import BrokenProcessPool
+    ready: Dict[int, Any] = {}
+    next_idx = 0
+    futures = {}
+    try:
+        with _pool_lock:
+            pool = _process_pool(workers)
+            for i, job in enumerate(jobs):
+                futures[pool.submit(fn, **job)] = i
+        report(0, "Starting", names[0])
+        for done, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            ready[i] = fut.result()
+            report(done, "Processed", names[i])
+            while next_idx in ready:
+                yield ready.pop(next_idx)
+                next_idx += 1
+    except BrokenProcessPool:
+        # a child died; the next job gets a fresh pool
+        _drop_process_pool(pool)
+        raise
+    finally:
+        # abandoned early (error or generator closed): don't leave this job's files queued
+        for fut in futures:
+            fut.cancel()
+
+
+# ---------- Report writers ----------
+# Rows go to disk as each file finishes (in file order), so a report never holds the
+# whole table. xlsx uses openpyxl's write-only mode, which streams the sheet to a
+# temporary file and only zips it up on close.
+
+REPORT_COLUMNS = ("File", "HasFooter", "PageNumber", "HTMLPath", "TXTPath", "Patched", "PatchNote")
+REPORT_FORMATS = ("xlsx", "csv", "jsonl")
+DEFAULT_REPORT_FORMAT = "xlsx"
+
+# stage_timings=True: four columns per pipeline stage, blank where a stage did not run
+TIMING_COLUMNS = tuple(f"{stage}{field}" for stage in PIPELINE_STAGES for field in ("WallMs", "CpuMs", "In", "Out"))
+
+def _timing_record(r: Dict[str, Any]) -> Tuple[Any, ...]:
+    timings = r.get("timings") or {}
+    record: List[Any] = []
+    for stage in PIPELINE_STAGES:
+        rec = timings.get(stage)
+        if rec is None:
+            record += [None] * 4
+        else:
+            record += [round(rec["wall_ms"], 3), round(rec["cpu_ms"], 3), rec["in"], rec["out"]]
+    return tuple(record)
+
+def _report_record(r: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        Path(r["input_file"]).name,
+        "Yes" if r["has_footer"] else "No",
+        r["page_number"],
+        Path(r["output_html"]).name,
+        Path(r["output_txt"]).name,
+        "Yes" if r.get("patched") else "No",
+        r.get("patch_note", "")
+    )
+
+
+class ReportWriter:
+    """
+    Streams report rows into output_folder/reading_report.<fmt>; close() returns the path.
+    timings=True appends TIMING_COLUMNS from each row's stage timings.
+    """
+
+    def __init__(self, output_folder: Path, fmt: str = DEFAULT_REPORT_FORMAT, timings: bool = False):
+        if fmt not in REPORT_FORMATS:
+            raise ValueError(f"Unknown report format {fmt!r}; expected one of {REPORT_FORMATS}")
+        self.fmt = fmt
+        self.timings = timings
+        self.columns = REPORT_COLUMNS + TIMING_COLUMNS if timings else REPORT_COLUMNS
+        self.path = Path(output_folder) / f"reading_report.{fmt}"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if fmt == "xlsx":
+            from openpyxl import Workbook
+            self._book = Workbook(write_only=True)
+            self._sheet = self._book.create_sheet("Sheet1")
+            self._sheet.append(self.columns)
+        else:
+            self._fh = open(self.path, "w", encoding="utf-8", newline="")
+            if fmt == "csv":
+                self._csv = csv.writer(self._fh)
+                self._csv.writerow(self.columns)
+
+    def write(self, row: Dict[str, Any]) -> None:
+        record = _report_record(row)
+        if self.timings:
+            record += _timing_record(row)
+        if self.fmt == "xlsx":
+            self._sheet.append(record)
+        elif self.fmt == "csv":
+            self._csv.writerow(record)
+        else:
+            self._fh.write(json.dumps(dict(zip(self.columns, record)), ensure_ascii=False) + "\n")
+
+    def close(self) -> Path:
+        if self.fmt == "xlsx":
+            self._book.save(self.path)
+        else:
+            self._fh.close()
+        return self.path
+
+
+class _ReportSink:
+    # A failing report must not fail the run: the first error drops the report (path None).
+    # Used as a context manager: the report is finished when the block completes and
+    # discarded if it raises.
+    def __init__(self, output_folder: Path, fmt: str, timings: bool = False):
+        self.path: Optional[Path] = None
+        try:
+            self.writer: Optional[ReportWriter] = ReportWriter(output_folder, fmt, timings)
+        except ValueError:
+            raise
+        except Exception:
+            self.writer = None
+
+    def write(self, row: Dict[str, Any]) -> None:
+        if self.writer is None:
+            return
+        try:
+            self.writer.write(row)
+        except Exception:
+            self._drop()
+
+    def _drop(self) -> None:
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            try:
+                writer.close()
+                writer.path.unlink()
+            except Exception:
+                pass
+
+    def __enter__(self) -> "_ReportSink":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is not None:
+            self._drop()
+        elif self.writer is not None:
+            try:
+                self.path = self.writer.close()
+            except Exception:
+                self.path = None
+
+
+def _progress_reporter(progress_callback: Optional[Callable[[int, int, str, str], None]], total: int) -> Callable[[int, str, str], None]:
+    def report(current: int, stage: str, name: str) -> None:
+        if progress_callback:
+            try:
+                progress_callback(current, total, stage, name)
+            except Exception:
+                pass
+    return report
+
+
 def process_folder(
     input_folder: Path,
     output_folder: Path,
@@ -1256,58 +2635,283 @@ def process_folder(
     h1_candidates: Optional[List[str]] = None,
     patch_enabled: bool = True,
     backup_enabled: bool = False,
-    insert_after_id: str = "parent-p1"
+    insert_after_id: str = "parent-p1",
+    workers: int = 1,
+    parser_backend: str = DEFAULT_PARSER_BACKEND,
+    result_cache: Optional[ResultCache] = None,
+    manifest_path: Optional[Path] = None,
+    report_format: str = DEFAULT_REPORT_FORMAT,
+    stage_timings: bool = False,
+    profiler: Optional[str] = None
 ) -> Optional[Path]:
     """
-    Process all HTML/XHTML files inside input_folder, write outputs into output_folder.
-    Returns path to Excel report (or None if no files).
+    Process the spine documents of the EPUB extracted at input_folder (every HTML/XHTML
+    file if it has no OPF spine), write outputs into output_folder.
+    Returns path to the report (or None if no files); report_format is one of REPORT_FORMATS.
     progress_callback(current, total, stage, filename) optional.
+    workers > 1 spreads files over the shared process pool; report rows keep file order.
+    parser_backend picks how chapters are parsed (see PARSER_BACKENDS).
+    result_cache (a ResultCache) reuses pipeline results of chapters seen before.
+    manifest_path enables incremental rebuilds: files left unchanged since the run that
+    wrote the manifest are skipped (stage "Reused"), and the manifest is rewritten.
+    stage_timings adds per-stage timing columns to the report; profiler (one of PROFILERS)
+    writes a "<stem>-profile" per processed file into output_folder.
     """
     feature_titles = feature_titles or []
     h1_candidates = h1_candidates or []
+    _check_profiler(profiler)
 
     files = _collect_files(input_folder)
     total = len(files)
-    rows: List[Dict[str, Any]] = []
 
     if total == 0:
         return None
 
-    for idx, fp in enumerate(files, start=1):
-        if progress_callback:
+    job_kwargs = dict(
+        output_folder=output_folder,
+        feature_titles=feature_titles,
+        h1_candidates=h1_candidates,
+        patch_enabled=patch_enabled,
+        backup_enabled=backup_enabled,
+        parser_backend=parser_backend,
+        result_cache=result_cache,
+        profiler=profiler,
+        insert_after_id=insert_after_id,
+        stage_timings=stage_timings
+    )
+    report = _progress_reporter(progress_callback, total)
+
+    options = dict(pipeline=PIPELINE_VERSION, feature_titles=feature_titles, h1_candidates=h1_candidates,
+                   patch_enabled=patch_enabled, backup_enabled=backup_enabled, parser_backend=parser_backend,
+                   insert_after_id=insert_after_id)
+    previous = _load_manifest(manifest_path, options) if manifest_path else {}
+    digests: Dict[Path, Optional[str]] = {}
+    rows: List[Optional[Dict[str, Any]]] = [None] * total
+    if previous:
+        for i, fp in enumerate(files):
+            entry = previous.get(fp.relative_to(input_folder).as_posix())
+            digests[fp] = _file_digest(fp)
+            if (entry and digests[fp] is not None and entry.get("sha256") == digests[fp]
+                    and _stylesheets_unchanged(entry["row"].get("stylesheets"), lambda hrefs: _load_stylesheets(str(fp), hrefs))):
+                rows[i] = _reuse_outputs(entry["row"], fp, output_folder)
+
+    todo = [i for i, row in enumerate(rows) if row is None]
+    reused = total - len(todo)
+    if reused:
+        report(reused, "Reused", "")
+
+    results: Iterator[Dict[str, Any]] = iter(())
+    if todo:
+        jobs = [dict(input_file=files[i], **job_kwargs) for i in todo]
+        workers = max(1, min(workers or 1, len(todo)))
+        results = _run_in_order(process_file, jobs, [files[i].name for i in todo], workers,
+                                lambda current, stage, name: report(reused + current, stage, name))
+
+    # reused rows and fresh results, merged back into file order as they arrive
+    with _ReportSink(output_folder, report_format, stage_timings) as sink:
+        for i in range(total):
+            row = rows[i]
+            if row is None:
+                row = next(results)
+                # only the manifest needs the rows after they are written
+                if manifest_path:
+                    rows[i] = row
+            sink.write(row)
+
+    if result_cache is not None and todo and workers > 1:
+        # pool workers wrote through their own copies of the cache
+        result_cache.trim()
+
+    if manifest_path:
+        # processed files are hashed again: patching rewrote them in place
+        for i in todo:
+            digests[files[i]] = _file_digest(files[i])
+        _write_manifest(manifest_path, options, {
+            fp.relative_to(input_folder).as_posix(): {"sha256": digests[fp], "row": row}
+            for fp, row in zip(files, rows)
+        })
+
+    return sink.path
+
+
+# ---------- In-memory EPUB processing ----------
+# process_epub is process_folder without the extract/repack round trip: chapters are
+# read from the open source archive, their linked CSS is resolved inside it, and the
+# patched chapters are streamed into the output archive next to raw-copied members.
+
+_worker_archives: Dict[Tuple[str, int, int], zipfile.ZipFile] = {}
+
+def _read_member_or_none(zin: zipfile.ZipFile, name: str) -> Optional[bytes]:
+    try:
+        return zin.read(name)
+    except (KeyError, zipfile.BadZipFile):
+        return None
+
+def _collect_members(zin: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    spine = spine_documents(lambda name: _read_member_or_none(zin, name))
+    if spine:
+        names = set(zin.namelist())
+        members = [zin.getinfo(name) for name in spine if name in names]
+        if members:
+            return members
+    members = [i for i in zin.infolist()
+               if not i.is_dir() and (i.filename.endswith(".xhtml") or i.filename.endswith(".html"))]
+    return sorted(members, key=lambda i: i.filename.lower())
+
+
+def _process_archive_member(
+    zin: zipfile.ZipFile,
+    member: str,
+    output_folder: Path,
+    feature_titles: List[str],
+    h1_candidates: List[str],
+    patch_enabled: bool,
+    insert_after_id: str,
+    parser_backend: str,
+    result_cache: Optional[ResultCache] = None,
+    profiler: Optional[str] = None,
+    stage_timings: bool = False
+) -> Tuple[Dict[str, Any], Optional[bytes]]:
+    """process_file for one archive member; returns (report_row, patched_bytes), None if the member is unchanged."""
+    stem = posixpath.splitext(posixpath.basename(member))[0]
+    timings = StageTimings(count_nodes=stage_timings)
+    with _profiled(profiler, output_folder, stem), timings.stage("Total"):
+        with timings.stage("Read") as st:
             try:
-                progress_callback(idx-1, total, "Starting", fp.name)
+                data = zin.read(member)
             except Exception:
-                pass
-        info = process_file(
-            input_file=fp,
+                data = b""
+            html_src = strip_injected_block(_universal_newlines(data.decode("utf-8", errors="ignore")))
+            st["out"] = len(html_src)
+
+        doc = _process_html_cached(
+            result_cache,
+            html_src,
+            posixpath.basename(member),
+            lambda hrefs: _load_archive_stylesheets(zin, member, hrefs),
+            feature_titles,
+            h1_candidates,
+            parser_backend,
+            timings
+        )
+        with timings.stage("Write", len(doc["result_html"]) + len(doc["text_content"])):
+            output_html, output_txt = _write_reading_order(output_folder, stem, doc)
+
+        patched = False
+        patched_bytes = None
+        patch_note = ""
+        if patch_enabled:
+            with timings.stage("Patch", len(doc["insertion_fragment"])) as st:
+                try:
+                    content = decode_source(data)
+                    patched_html, patch_note = patch_html(content, doc["insertion_fragment"], insert_after_id)
+                except Exception as e:
+                    patched_html, patch_note = None, f"Patch error: {type(e).__name__}: {e}"
+                patched = patched_html is not None
+                if patched and patched_html is not content:
+                    patched_bytes = patched_html.encode("utf-8")
+                    st["out"] = len(patched_html)
+
+    return _report_row(member, output_html, output_txt, doc, patched, patch_note, timings), patched_bytes
+
+
+def _process_archive_member_at(archive_path: str, member: str, **kwargs: Any) -> Tuple[Dict[str, Any], Optional[bytes]]:
+    # Pool workers reopen the archive by path. Each keeps only the last one open: the
+    # workers outlive jobs, and an open handle pins a deleted upload's disk space.
+    st = os.stat(archive_path)
+    key = (archive_path, st.st_mtime_ns, st.st_size)
+    zin = _worker_archives.get(key)
+    if zin is None:
+        for old in _worker_archives.values():
+            old.close()
+        _worker_archives.clear()
+        zin = _worker_archives[key] = zipfile.ZipFile(archive_path)
+    return _process_archive_member(zin, member, **kwargs)
+
+
+def process_epub(
+    zin: zipfile.ZipFile,
+    zout: Optional[zipfile.ZipFile],
+    output_folder: Path,
+    progress_callback: Optional[Callable[[int, int, str, str], None]] = None,
+    feature_titles: Optional[List[str]] = None,
+    h1_candidates: Optional[List[str]] = None,
+    patch_enabled: bool = True,
+    backup_enabled: bool = False,
+    insert_after_id: str = "parent-p1",
+    workers: int = 1,
+    parser_backend: str = DEFAULT_PARSER_BACKEND,
+    result_cache: Optional[ResultCache] = None,
+    report_format: str = DEFAULT_REPORT_FORMAT,
+    stage_timings: bool = False,
+    profiler: Optional[str] = None
+) -> Optional[Path]:
+    """
+    process_folder for an open EPUB archive, without extracting it.
+    Reading-order outputs and the report go to output_folder as usual. If zout is
+    given the patched book is written there: mimetype first, patched chapters as they
+    finish, then every other member copied raw. backup_enabled keeps each original
+    chapter as a "<name>.bak" member, like process_folder leaves .bak files behind.
+    workers > 1 needs zin to be opened from a path, otherwise chapters run in-process.
+    stage_timings and profiler work as in process_folder.
+    Returns path to the report (or None if no chapters).
+    """
+    _check_profiler(profiler)
+    members = _collect_members(zin)
+    total = len(members)
+    infos = zin.infolist()
+
+    if zout is not None:
+        mime = next((i for i in infos if i.filename == "mimetype"), None)
+        if mime is not None:
+            zout.writestr(zipfile.ZipInfo("mimetype", date_time=mime.date_time), zin.read(mime), compress_type=zipfile.ZIP_STORED)
+
+    report_path = None
+    if total:
+        job_kwargs = dict(
             output_folder=output_folder,
-            feature_titles=feature_titles,
-            h1_candidates=h1_candidates,
+            feature_titles=feature_titles or [],
+            h1_candidates=h1_candidates or [],
             patch_enabled=patch_enabled,
-            backup_enabled=backup_enabled
+            insert_after_id=insert_after_id,
+            parser_backend=parser_backend,
+            result_cache=result_cache,
+            profiler=profiler,
+            stage_timings=stage_timings
         )
-        rows.append(info)
-        if progress_callback:
-            try:
-                progress_callback(idx, total, "Processed", fp.name)
-            except Exception:
-                pass
-
-    # Write Excel report
-    try:
-        df = pd.DataFrame([{
-            "File": Path(r["input_file"]).name,
-            "HasFooter": "Yes" if r["has_footer"] else "No",
-            "PageNumber": r["page_number"],
-            "HTMLPath": Path(r["output_html"]).name,
-            "TXTPath": Path(r["output_txt"]).name,
-            "Patched": "Yes" if r.get("patched") else "No",
-            "PatchNote": r.get("patch_note","")
-        } for r in rows])
-        report_path = output_folder / "reading_report.xlsx"
-        df.to_excel(report_path, index=False)
-    except Exception:
-        report_path = None
+        workers = max(1, min(workers or 1, total))
+        if workers > 1 and zin.filename:
+            fn = _process_archive_member_at
+            jobs = [dict(archive_path=os.path.abspath(zin.filename), member=i.filename, **job_kwargs) for i in members]
+        else:
+            workers = 1
+            fn = functools.partial(_process_archive_member, zin)
+            jobs = [dict(member=i.filename, **job_kwargs) for i in members]
+
+        with _ReportSink(output_folder, report_format, stage_timings) as sink:
+            results = _run_in_order(fn, jobs, [posixpath.basename(i.filename) for i in members], workers,
+                                    _progress_reporter(progress_callback, total))
+            for info, (row, patched) in zip(members, results):
+                sink.write(row)
+                if zout is None:
+                    continue
+                if patched is None:
+                    _copy_zip_member_raw(zin, zout, info)
+                    continue
+                out = zipfile.ZipInfo(info.filename, date_time=time.localtime()[:6])
+                out.external_attr = info.external_attr
+                zout.writestr(out, patched, compress_type=zipfile.ZIP_DEFLATED)
+                if backup_enabled:
+                    _copy_zip_member_raw(zin, zout, info, arcname=info.filename + ".bak")
+        report_path = sink.path
+        if result_cache is not None and workers > 1:
+            # pool workers wrote through their own copies of the cache
+            result_cache.trim()
+
+    if zout is not None:
+        chapters = {i.filename for i in members}
+        for info in infos:
+            if info.filename != "mimetype" and info.filename not in chapters:
+                _copy_zip_member_raw(zin, zout, info)
 
     return report_path